@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import multiprocessing
+import sys
+
+from zodiacquest import World, You, Dictionary, EventLog, QUIT_CMD, render_text
+
+def parse_script(lines):
+    """ commands from script lines, skipping blank lines and # comments """
+    commands = []
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            commands.append(line.upper())
+    return commands
+
+def read_stream(stream):
+    """ (name, commands) for each session in stream, sessions separated by blank lines """
+    sessions = []
+    lines = []
+    for line in stream:
+        if line.strip():
+            lines.append(line)
+        elif lines:
+            sessions.append(("stdin:%s" % (len(sessions) + 1), parse_script(lines)))
+            lines = []
+    if lines:
+        sessions.append(("stdin:%s" % (len(sessions) + 1), parse_script(lines)))
+    return sessions
+
+def read_files(paths):
+    sessions = []
+    for path in paths:
+        with open(path, 'r') as f:
+            sessions.append((path, parse_script(f)))
+    return sessions
+
+def run_session(world, name, commands, start="A", coins=15, snapshot=None, events=False):
+    """ replay commands in a fresh game (or from a saved snapshot) and return its result record
+
+    With events, the record also lists every event of the session as
+    JSON, each tagged with the number of the command it came from. """
+    log = EventLog()
+    if snapshot is None:
+        you = You(world.new_game().regions[start], coins=coins, events=log)
+    else:
+        you = You.restore(world, snapshot, events=log)
+    errors = []
+    records = []
+    for i, cmd in enumerate(commands):
+        try:
+            ok = you.command(cmd)
+            exception = None
+        except Exception as e:
+            # one broken session should not stop the whole batch
+            ok = False
+            exception = "EXCEPTION: %s: %s" % (type(e).__name__, e)
+        command_events = log.pop()
+        if not ok:
+            message = render_text(command_events).strip()
+            if exception is not None:
+                message = "\n".join(filter(None, [message, exception]))
+            errors.append({"command": i + 1, "cmd": cmd, "message": message})
+        if events:
+            for event in command_events:
+                record = event.record
+                record["command"] = i + 1
+                records.append(record)
+        if you.quit:
+            break
+    result = {
+        "session": name,
+        "region": you.region.id,
+        "coins": you.coins,
+        "inventory": you.inventory.thing_names,
+        "steps": you.step,
+        "quit": you.quit,
+        "errors": errors,
+    }
+    if events:
+        result["events"] = records
+    return result
+
+# each worker process builds one world, mapping the dictionary caches the others map too, and replays many sessions in it
+_worker_world = None
+_worker_options = None
+
+def _init_worker(valid_things_dict, options):
+    global _worker_world, _worker_options
+    _worker_world = World(valid_things_dict)
+    _worker_options = options
+
+def _run_worker_session(session):
+    name, commands = session
+    return run_session(_worker_world, name, commands, **_worker_options)
+
+def run_batch(sessions, valid_things_dict="9C.txt", processes=None, chunksize=64, **options):
+    """ yield a result record for each (name, commands) session, in order
+
+    With processes, sessions are sharded across a pool of worker
+    processes, each reusing a single World. """
+    if not processes:
+        world = World(valid_things_dict)
+        for name, commands in sessions:
+            yield run_session(world, name, commands, **options)
+        return
+    # build the dictionary cache once, here, rather than in every worker
+    Dictionary(valid_things_dict).words
+    with multiprocessing.Pool(processes, _init_worker, (valid_things_dict, options)) as pool:
+        yield from pool.imap(_run_worker_session, sessions, chunksize)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay command scripts without a prompt, one JSON result line per session. "
+        "Each file is one session; with no files (or -), sessions are read from stdin separated by blank lines.")
+    parser.add_argument("scripts", nargs="*", help="script files, one command per line (%s... to quit)" % QUIT_CMD)
+    parser.add_argument("--processes", type=int, default=None, help="shard sessions across this many worker processes")
+    parser.add_argument("--start", default="A", help="region each session starts in (default: A)")
+    parser.add_argument("--coins", type=int, default=15, help="coins each session starts with (default: 15)")
+    parser.add_argument("--snapshot", default=None, help="start every session from this saved game (JSON) instead")
+    parser.add_argument("--events", action="store_true", help="include every event (moves, errors...) in the records")
+    parser.add_argument("--dictionary", default="9C.txt", help="valid things dictionary (default: 9C.txt)")
+    args = parser.parse_args()
+
+    snapshot = None
+    if args.snapshot:
+        with open(args.snapshot, 'r') as f:
+            snapshot = json.load(f)
+
+    if not args.scripts or args.scripts == ["-"]:
+        sessions = read_stream(sys.stdin)
+    else:
+        sessions = read_files(args.scripts)
+    for record in run_batch(sessions, args.dictionary, args.processes, start=args.start.upper(), coins=args.coins, snapshot=snapshot,
+                            events=args.events):
+        sys.stdout.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+if __name__ == "__main__":
+    main()
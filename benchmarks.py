@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from solver import Problem, Solver
+from zodiacquest import (World, WorldMap, Dictionary, WordStore, You, Thing, Person, Inventory,
+                         NullSink, TextSink, JsonLinesSink, PhoneticIndex, HiddenNameIndex, HIDDEN_NAMES,
+                         DeletionIndex, WordGraph, TurnView, GEMS, GO_CMD, TAKE_CMD, LEAVE_CMD)
+
+# the startup target: python zodiacquest.py has to reach its first prompt within this
+MAX_STARTUP_MS = 100
+
+def time_to_first_prompt(script="zodiacquest.py"):
+    """ seconds from starting python on the game to its first prompt """
+    start = time.perf_counter()
+    game = subprocess.Popen([sys.executable, script], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    output = b""
+    while not output.endswith(b"> "):
+        data = os.read(game.stdout.fileno(), 4096)
+        if not data:
+            raise RuntimeError("%s exited before its first prompt" % script)
+        output += data
+    elapsed = time.perf_counter() - start
+    game.communicate(b"Q\n")
+    return elapsed
+
+def traced_bytes(fn):
+    """ (bytes still allocated after fn, peak bytes allocated during it, fn's result) """
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        result = fn()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return current - start, peak - start, result
+
+def process_memory():
+    """ {"rss", "pss", "uss"} bytes of this process, from /proc/self/smaps_rollup (None where there is no such file)
+
+    uss counts only the pages no other process shares; pss splits each
+    shared page between the processes sharing it. """
+    try:
+        with open("/proc/self/smaps_rollup", 'r') as f:
+            fields = dict((line.split(":")[0], int(line.split()[1]) * 1024) for line in f if line.rstrip().endswith(" kB"))
+    except OSError:
+        return None
+    return {"rss": fields["Rss"], "pss": fields["Pss"], "uss": fields["Private_Clean"] + fields["Private_Dirty"]}
+
+def _dictionary_worker(path, shared, words, ready, results):
+    # a worker that checks some things, then reports its memory once every worker is up
+    before = process_memory()
+    dictionary = Dictionary(path, shared)
+    for word in words:
+        word in dictionary.words
+        dictionary.near(word, 1)
+        dictionary.phonetic_index.transformations(word)
+    ready.wait()
+    after = process_memory()
+    results.put(dict((key, after[key] - before[key]) for key in after))
+    ready.wait()
+
+def synthetic_map(n_regions, extra_portals=1.0, seed=0):
+    """ a world definition with n_regions regions, to see how things scale past 21
+
+    Regions are joined by a random spanning tree, so every region is
+    reachable, plus about extra_portals * n_regions more portals. """
+    rng = random.Random(seed)
+    regions = [{"id": "R%s" % i, "name": "SYNTHETIC REGION %s" % i} for i in range(n_regions)]
+    pairs = set()
+    for i in range(1, n_regions):
+        pairs.add((rng.randrange(i), i))
+    target = min(n_regions - 1 + int(extra_portals * n_regions), n_regions * (n_regions - 1) // 2)
+    while len(pairs) < target:
+        a, b = sorted(rng.sample(range(n_regions), 2))
+        pairs.add((a, b))
+    portals = [{"between": ["R%s" % a, "R%s" % b], "cost": rng.randint(1, 3)} for a, b in sorted(pairs)]
+    things = [{"region": "R%s" % rng.randrange(n_regions), "type": "Person", "names": [name], "moveable": True}
+              for name in ["RUBY", "MOUSE", "LEI"]]
+    return {"regions": regions, "portals": portals, "things": things}
+
+class Benchmarks:
+    """ times each stage and keeps the results, so runs can be saved and compared """
+
+    def __init__(self, repeat=3):
+        self._repeat = repeat
+        self.results = dict()
+
+    def timed(self, label, fn, number=1):
+        """ best mean time per call of fn over repeat runs of number calls """
+        best = None
+        for _ in range(self._repeat):
+            start = time.perf_counter()
+            for _ in range(number):
+                fn()
+            elapsed = (time.perf_counter() - start) / number
+            best = elapsed if best is None else min(best, elapsed)
+        self.record(label, best)
+        if best < 1e-3:
+            print("%-50s %10.2f us" % (label, best * 1e6))
+        else:
+            print("%-50s %10.2f ms" % (label, best * 1e3))
+        return best
+
+    def record(self, label, seconds):
+        self.results[label] = {"seconds": seconds, "ops_per_sec": 1 / seconds if seconds > 0 else None}
+
+    def startup(self, number=5):
+        best = min(time_to_first_prompt() for _ in range(number))
+        self.record("startup: time to first prompt", best)
+        print("%-50s %10.2f ms" % ("startup: time to first prompt", best * 1e3))
+        return best
+
+    def record_bytes(self, label, n_bytes):
+        self.results[label] = {"bytes": n_bytes}
+        print("%-50s %10.0f bytes" % (label, n_bytes))
+
+    def memory(self, world, sessions=500):
+        """ bytes per game session and per solver search state, measured with tracemalloc """
+        script = [GO_CMD + "B", GO_CMD + "F", TAKE_CMD + "RUBY", GO_CMD + "B", LEAVE_CMD + "RUBY", GO_CMD + "A"]
+        def game_world():
+            game = world.new_game()
+            game.regions["F"].inventory.add(Person(["RUBY"], moveable=True))
+            return game
+        def play(you):
+            for cmd in script:
+                you.command(cmd)
+            you.description
+            you.commands
+            return you
+        def new_sessions():
+            return [play(You(game_world().regions["A"], coins=15)) for _ in range(sessions)]
+        shared = game_world()
+        def shared_sessions():
+            return [play(You(shared.regions["A"], coins=15, copy_on_write=True)) for _ in range(sessions)]
+        retained, peak, kept = traced_bytes(new_sessions)
+        self.record_bytes("memory: per session (own world)", retained / sessions)
+        retained, peak, kept = traced_bytes(shared_sessions)
+        self.record_bytes("memory: per session (copy-on-write, shared world)", retained / sessions)
+        del kept
+
+        game = game_world()
+        game.regions["D"].inventory.add(Thing(["OPAL"]))
+        game.regions["B"].inventory.add(Person(["MOUSE"], moveable=True))
+        problem = Problem(game, You(game.regions["A"], coins=10), goal_things=["NOTHING"])
+        retained, peak, solution = traced_bytes(lambda: Solver(problem).solve("bfs"))
+        self.record_bytes("memory: per search state (%s states, bfs)" % solution.nodes, peak / solution.nodes)
+
+    def world_construction(self, dictionary_path="9C.txt", map_file="world.json"):
+        self.timed("world: %s load (uncached)" % dictionary_path, lambda: WordStore.from_file(dictionary_path))
+        self.timed("world: %s load (cached)" % dictionary_path, lambda: Dictionary(dictionary_path).words, number=10)
+        self.timed("world: map compile", lambda: WorldMap.load(map_file), number=100)
+        dictionary = Dictionary(dictionary_path)
+        world_map = WorldMap.load(map_file)
+        def region_graph():
+            world = World.__new__(World)
+            world.map = world_map
+            world._construct_regions()
+            world._construct_portals()
+            return world
+        def region_graph_and_things():
+            region_graph()._construct_things()
+        self.timed("world: region graph build", region_graph, number=1000)
+        self.timed("world: region graph build + thing placement", region_graph_and_things, number=1000)
+        self.timed("world: World() total", lambda: World(dictionary=dictionary, world_map=world_map), number=100)
+        world = World(dictionary=dictionary, world_map=world_map)
+        self.timed("world: new_game()", world.new_game, number=1000)
+
+    def workers(self, dictionary_path="9C.txt", counts=(1, 2, 4, 8), sample=200):
+        """ memory each worker process spends on the dictionary, as more workers use it at once
+
+        Workers are started fresh (spawned, so they share nothing they
+        did not map themselves), each checks a sample of words against
+        the dictionary and its indexes, and all of them measure at once.
+        With the dictionary shared, what each worker holds privately
+        (uss) should stay flat as workers are added, and its share of
+        the shared pages (pss) should fall. """
+        if process_memory() is None:
+            print("workers: skipped (no /proc/self/smaps_rollup)")
+            return
+        dictionary = Dictionary(dictionary_path)
+        # build every cache once, before the workers attach to them
+        dictionary.phonetic_index, dictionary.deletion_index
+        words = random.Random(0).sample(list(dictionary.words), sample)
+        context = multiprocessing.get_context("spawn")
+        for shared in [True, False]:
+            for n in counts:
+                ready = context.Barrier(n)
+                results = context.Queue()
+                processes = [context.Process(target=_dictionary_worker,
+                                             args=(dictionary_path, shared, words, ready, results)) for _ in range(n)]
+                for process in processes:
+                    process.start()
+                memory = [results.get() for _ in processes]
+                for process in processes:
+                    process.join()
+                label = "workers: %s x %s dictionary" % (n, "shared" if shared else "private")
+                for key in ["uss", "pss", "rss"]:
+                    self.record_bytes("%s, %s per worker" % (label, key), sum(m[key] for m in memory) / n)
+
+    def valid_things(self, world):
+        words = ["CANCER", "POTION", "ZZZZQ", "OCEAN", "SATIRIST", "XYZZY", "LEO", "STOC"]
+        def lookups():
+            for word in words:
+                world.valid_thing_p(word)
+        per_batch = self.timed("valid_thing_p x%s (hits and misses)" % len(words), lookups, number=10000)
+        self.record("valid_thing_p per lookup", per_batch / len(words))
+
+    def phonetic_index(self, world):
+        words = world.valid_things
+        self.timed("phonetic index build (uncached)", lambda: PhoneticIndex(words))
+        self.timed("phonetic index load (cached)", lambda: PhoneticIndex.load(world.dictionary.path, words), number=5)
+        index = world.phonetic_index
+        self.timed("transformations(OCEAN)", lambda: index.transformations("OCEAN"), number=10000)
+        self.timed("transformable_p(ANSWER, CANCER)", lambda: index.transformable_p("ANSWER", "CANCER"), number=10000)
+
+    def hidden_names(self, world):
+        words = list(world.valid_things)
+        self.timed("hidden name index build (uncached)", lambda: HiddenNameIndex(words))
+        self.timed("hidden name index load (cached)", lambda: HiddenNameIndex.load(world.dictionary.path, words), number=5)
+        index = world.hidden_name_index
+        self.timed("zodiac_words", lambda: index.zodiac_words, number=1000)
+        self.timed("HIDDEN_NAMES.names_in(SCORPIOPALEOGEMINI)", lambda: HIDDEN_NAMES.names_in("SCORPIOPALEOGEMINI"),
+                   number=10000)
+
+    def suggestions(self, world):
+        words = world.valid_things
+        self.timed("deletion index load (cached)", lambda: DeletionIndex.load(world.dictionary.path, words), number=5)
+        index = world.dictionary.deletion_index
+        self.timed("near(OCEEN, 1)", lambda: index.near("OCEEN", 1), number=1000)
+        self.timed("near(POTOIN, 2)", lambda: index.near("POTOIN", 2), number=20)
+        names = world.map.name_index
+        self.timed("region names near(MOUNTAN HEIGHTS, 2)", lambda: names.near("MOUNTAN HEIGHTS", 2), number=1000)
+
+    def word_graph(self, world):
+        words = world.valid_things
+        self.timed("word graph build (uncached)", lambda: WordGraph(words))
+        self.timed("word graph load (cached)", lambda: WordGraph.load(world.dictionary.path, words), number=5)
+        graph = world.dictionary.word_graph
+        self.timed("neighbours(CANCER)", lambda: graph.neighbours("CANCER"), number=1000)
+        self.timed("anagrams(LISTEN)", lambda: graph.anagrams("LISTEN"), number=10000)
+        self.timed("ladder(CAT, DOG)", lambda: graph.ladder("CAT", "DOG"), number=100)
+        self.timed("ladder(COLD, WARM)", lambda: graph.ladder("COLD", "WARM"), number=20)
+        self.timed("ladder(OCEAN, POTION)", lambda: graph.ladder("OCEAN", "POTION"), number=20)
+
+    def turn(self, world, label="turn"):
+        world = world.new_game()
+        region = max(world.regions, key=lambda region: len(region.portals))
+        region.inventory.add(Person(["RUBY"], moveable=True))
+        you = You(region, coins=15)
+        def uncached_turn():
+            view = TurnView(you, None)
+            view.description
+            view.commands
+        def cached_turn():
+            you.description
+            you.commands
+        self.timed("%s: render (from scratch)" % label, uncached_turn, number=5000)
+        self.timed("%s: render (cached view)" % label, cached_turn, number=5000)
+
+    def dispatch(self, world, label="dispatch"):
+        world = world.new_game()
+        region = next(iter(world.regions))
+        destination = next(iter(region.portals)).destination(region)
+        region.inventory.add(Person(["RUBY"], moveable=True))
+        you = You(region, coins=10 ** 9, events=NullSink())
+        go_there = "%s%s" % (GO_CMD, destination.id)
+        go_back = "%s%s" % (GO_CMD, region.id)
+        def go():
+            you.command(go_there)
+            you.command(go_back)
+        def take_and_leave():
+            you.command(TAKE_CMD + "RUBY")
+            you.command(LEAVE_CMD + "RUBY")
+        self.record("%s: G command" % label, self.timed("%s: G there and back" % label, go, number=5000) / 2)
+        self.record("%s: T/L command" % label, self.timed("%s: T then L" % label, take_and_leave, number=5000) / 2)
+        script = [go_there, TAKE_CMD + "RUBY", go_back, LEAVE_CMD + "RUBY", TAKE_CMD + "RUBY", LEAVE_CMD + "RUBY"] * 100
+        def one_by_one():
+            for cmd in script:
+                you.command(cmd)
+        self.record("%s: command x%s, one by one" % (label, len(script)), self.timed(
+            "%s: %s commands one by one" % (label, len(script)), one_by_one, number=20) / len(script))
+        self.record("%s: command x%s, apply_many" % (label, len(script)), self.timed(
+            "%s: %s commands with apply_many" % (label, len(script)), lambda: you.apply_many(script), number=20) / len(script))
+        self.timed("%s: legal_p(G there)" % label, lambda: you.legal_p(go_there), number=10000)
+        self.timed("%s: legal_p(bad T)" % label, lambda: you.legal_p(TAKE_CMD + "NOTHING"), number=10000)
+
+    def sinks(self, world):
+        """ the cost of each event sink on a command that reports an error (two events) """
+        region = world.new_game().regions["A"]
+        for name, sink in [("null", NullSink()), ("text", TextSink(io.StringIO())),
+                           ("json lines", JsonLinesSink(io.StringIO(), session="bench"))]:
+            you = You(region, coins=15, events=sink)
+            def bad_go():
+                you.command(GO_CMD + "Z")
+                sink.flush()
+            self.timed("events: bad G with %s sink" % name, bad_go, number=5000)
+
+    def inventory(self, sizes=(10, 100, 1000, 10000)):
+        gem = Thing([GEMS[1]])
+        for size in sizes:
+            inventory = Inventory()
+            for i in range(size):
+                inventory.add(Thing(["THING%s" % i], ["STRING%s" % i]))
+            def add_and_remove():
+                inventory.add(gem)
+                inventory.remove(gem)
+            self.timed("inventory[%s]: add + remove" % size, add_and_remove, number=5000)
+            self.timed("inventory[%s]: have_gem_p" % size, lambda: inventory.have_gem_p, number=20000)
+
+    def scaled_worlds(self, dictionary, sizes):
+        for size in sizes:
+            world_map = WorldMap(synthetic_map(size))
+            self.timed("synthetic[%s]: World()" % size, lambda: World(dictionary=dictionary, world_map=world_map))
+            world = World(dictionary=dictionary, world_map=world_map)
+            self.timed("synthetic[%s]: new_game()" % size, world.new_game, number=100)
+            self.turn(world, "synthetic[%s] turn" % size)
+            self.dispatch(world, "synthetic[%s] dispatch" % size)
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline, threshold=0.10):
+    """ print each result next to a saved run, flagging anything more than threshold slower (or larger) """
+    print("\n%-50s %10s %10s %8s" % ("benchmark", "baseline", "now", "ratio"))
+    for label, result in results.items():
+        if label not in baseline:
+            continue
+        metric = "seconds" if "seconds" in result else "bytes"
+        if metric not in baseline[label]:
+            continue
+        before = baseline[label][metric]
+        ratio = result[metric] / before if before else float("inf")
+        if ratio > 1 + threshold:
+            flag = "  SLOWER" if metric == "seconds" else "  LARGER"
+        elif ratio < 1 - threshold:
+            flag = "  faster" if metric == "seconds" else "  smaller"
+        else:
+            flag = ""
+        print("%-50s %10.3g %10.3g %7.2fx%s" % (label, before, result[metric], ratio, flag))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark world building, dictionary lookups, turns and commands")
+    parser.add_argument("--json", default=None, help="write results to this JSON file")
+    parser.add_argument("--compare", default=None, help="compare against results saved earlier with --json")
+    parser.add_argument("--scale", default="21,100,200",
+                        help="comma separated region counts for synthetic worlds (default: 21,100,200)")
+    parser.add_argument("--skip-phonetic", action="store_true", help="skip the (slow) phonetic index build")
+    parser.add_argument("--skip-word-graph", action="store_true", help="skip the (slow) word graph benchmarks")
+    parser.add_argument("--max-startup-ms", type=float, default=MAX_STARTUP_MS,
+                        help="fail (exit status 1) if the time to the first prompt is over this "
+                        "(default: %s; 0 to not check)" % MAX_STARTUP_MS)
+    parser.add_argument("--memory-only", action="store_true", help="only report memory per session and search state")
+    parser.add_argument("--startup-only", action="store_true", help="only measure the time to the first prompt")
+    parser.add_argument("--workers-only", action="store_true",
+                        help="only report the dictionary memory per worker process as workers are added")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per benchmark, keeping the best (default: 3)")
+    args = parser.parse_args()
+
+    benchmarks = Benchmarks(repeat=args.repeat)
+    startup = None
+    if args.memory_only:
+        benchmarks.memory(World())
+    elif args.workers_only:
+        benchmarks.workers()
+    else:
+        startup = benchmarks.startup()
+    if not args.startup_only and not args.memory_only and not args.workers_only:
+        benchmarks.world_construction()
+        world = World()
+        benchmarks.valid_things(world)
+        if not args.skip_phonetic:
+            benchmarks.phonetic_index(world)
+        benchmarks.hidden_names(world)
+        benchmarks.suggestions(world)
+        if not args.skip_word_graph:
+            benchmarks.word_graph(world)
+        benchmarks.turn(world)
+        benchmarks.dispatch(world)
+        benchmarks.sinks(world)
+        benchmarks.inventory()
+        benchmarks.scaled_worlds(world.dictionary, [int(size) for size in args.scale.split(",") if size])
+        benchmarks.memory(world)
+        benchmarks.workers()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"revision": git_revision(), "python": platform.python_version(),
+                       "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": benchmarks.results}, f, indent=1)
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare(benchmarks.results, json.load(f)["results"])
+    if args.max_startup_ms and startup is not None and startup * 1e3 > args.max_startup_ms:
+        print("FAILED: time to first prompt %.1fms is over the %.1fms target" % (startup * 1e3, args.max_startup_ms))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
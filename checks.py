@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+import argparse
+import random
+import string
+import sys
+from collections import Counter
+
+from zodiacquest import World, You, Thing, Person, NullSink, Dictionary, ZODIACS, GEMS, edit_distance
+
+def _candidates(you, world):
+    """ commands worth asking about from here: every region by id and by name, and every name of a thing nearby """
+    cmds = []
+    for region in world.regions:
+        cmds.append("G%s" % region.id)
+        cmds.append("G%s" % region.name)
+    for inventory in (you.inventory, you.region_inventory):
+        for thing in inventory.things:
+            for name in thing.names:
+                cmds.append("T %s" % name)
+                cmds.append("L %s" % name)
+    cmds += ["T NOTHING", "L NOTHING", "U", "R"]
+    return cmds
+
+def check_legal(steps=300, seed=0, coins=15):
+    """ random walks comparing You.legal_p with what command() actually does, and with the commands
+    offered: (commands checked, mismatches)
+
+    Each candidate is tried for real and then taken back (an undo
+    after a go/take/leave or a redo, a redo after an undo), so the walk
+    carries on from the same state. """
+    rng = random.Random(seed)
+    world = World()
+    # something to carry, things sharing a name (SEA picks out neither, OCEAN one), and one that can't be moved
+    world.regions["A"].inventory.add(Thing(["RUBY"]))
+    world.regions["B"].inventory.add(Thing(["SEA", "OCEAN"]))
+    world.regions["B"].inventory.add(Thing(["SEA"]))
+    world.regions["B"].inventory.add(Thing(["POTION"]))
+    world.regions["E"].inventory.add(Thing(["POTION"]))
+    world.regions["F"].inventory.add(Person(["STATUE"]))
+    you = You(world.regions["A"], coins=coins, events=NullSink())
+    # and one you carry that can't be put down
+    you.inventory.add(Person(["IDOL"]))
+    mismatches = []
+    checked = 0
+    for step in range(steps):
+        for cmd in _candidates(you, world):
+            expected = you.legal_p(cmd)
+            done = you.command(cmd)
+            if done:
+                you.command("R" if cmd == "U" else "U")
+            checked += 1
+            if bool(done) != expected:
+                mismatches.append("step %s, in %s with %s coins: legal_p(%r) is %s but the command %s"
+                                  % (step, you.region.id, you.coins, cmd, expected,
+                                     "succeeds" if done else "fails"))
+        # and every command the prompt offers has to be legal
+        for cmd in you.commands:
+            checked += 1
+            if not you.legal_p(cmd):
+                mismatches.append("step %s, in %s with %s coins: %r is offered but legal_p is False"
+                                  % (step, you.region.id, you.coins, cmd))
+        moves = [cmd for cmd in you.commands] + ["U"]
+        you.command(rng.choice(moves))
+        if you.coins < 2 and rng.random() < 0.2:
+            # keep wandering rather than getting stuck for good
+            you.coins = coins
+    return checked, mismatches
+
+def _sample_words(dictionary, count, rng):
+    """ count valid things picked at random (with repeats) """
+    words = dictionary.words
+    return [words.word(rng.randrange(len(words))) for i in range(count)]
+
+def check_hidden(steps=300, seed=0, path="9C.txt"):
+    """ sampled valid things (and a few strings that are not valid things) comparing
+    HiddenNameIndex.hits with looking for every zodiac and gem name in the word: (words checked, mismatches) """
+    rng = random.Random(seed)
+    dictionary = Dictionary(path)
+    index = dictionary.hidden_name_index
+    strings = _sample_words(dictionary, steps, rng) + ["", "NOTAVALIDTHINGARIES", "ruby"]
+    mismatches = []
+    for word in strings:
+        if word.upper() in dictionary.words:
+            expected = tuple(sorted(set(name for name in ZODIACS + GEMS if name in word.upper())))
+        else:
+            expected = ()
+        hits = index.hits(word)
+        if hits != expected:
+            mismatches.append("hits(%r) is %r but the names in it are %r" % (word, hits, expected))
+        for name in hits:
+            if word.upper() not in index.words_containing(name):
+                mismatches.append("%r has %s hidden in it but is not in words_containing(%r)" % (word, name, name))
+    return len(strings), mismatches
+
+def _typo(word, edits, rng):
+    """ word with edits random letters inserted, deleted, changed or swapped with the next """
+    for i in range(edits):
+        at = rng.randrange(len(word) + 1)
+        kind = rng.choice("IDCS") if at < len(word) - 1 else rng.choice("IDC") if at < len(word) else "I"
+        if kind == "I":
+            word = word[:at] + rng.choice(string.ascii_uppercase) + word[at:]
+        elif kind == "D":
+            word = word[:at] + word[at + 1:]
+        elif kind == "C":
+            word = word[:at] + rng.choice(string.ascii_uppercase) + word[at + 1:]
+        else:
+            word = word[:at] + word[at + 1] + word[at] + word[at + 2:]
+    return word
+
+def check_near(steps=300, seed=0, path="9C.txt"):
+    """ sampled typos of valid things comparing DeletionIndex.near with working out the edit distance to
+    every valid thing: (strings checked, mismatches)
+
+    The linear pass takes a tenth of a second or more a string, so only
+    one string is tried for every ten steps. """
+    rng = random.Random(seed)
+    dictionary = Dictionary(path)
+    index = dictionary.deletion_index
+    by_length = dict()
+    for word in dictionary.words:
+        by_length.setdefault(len(word), []).append(word)
+    strings = [_typo(word, rng.randrange(4), rng) for word in _sample_words(dictionary, max(1, steps // 10), rng)]
+    mismatches = []
+    for typo in strings:
+        max_distance = rng.randrange(3)
+        letters = Counter(typo)
+        expected = []
+        for length in range(len(typo) - max_distance, len(typo) + max_distance + 1):
+            for word in by_length.get(length, []):
+                # each edit adds or takes away at most two letters, so a word whose letters differ by more is too far
+                difference = Counter(word)
+                difference.subtract(letters)
+                if sum(map(abs, difference.values())) > 2 * max_distance:
+                    continue
+                distance = edit_distance(typo, word)
+                if distance <= max_distance:
+                    expected.append((distance, word))
+        expected.sort()
+        found = index.near(typo, max_distance)
+        if found != expected:
+            mismatches.append("near(%r, %s) found %s but %s are that close (%s missed, %s extra)"
+                              % (typo, max_distance, len(found), len(expected),
+                                 sorted(set(expected) - set(found))[:5], sorted(set(found) - set(expected))[:5]))
+    return len(strings), mismatches
+
+def _one_letter_apart_p(a, b):
+    """ whether b is a with one letter changed, added or taken away """
+    if len(a) == len(b):
+        return sum(x != y for x, y in zip(a, b)) == 1
+    if len(a) > len(b):
+        a, b = b, a
+    return len(b) == len(a) + 1 and any(b[:i] + b[i + 1:] == a for i in range(len(b)))
+
+def _ladder_length(graph, from_word, to_word, with_anagrams, max_steps):
+    """ steps on the shortest ladder by a plain breadth first search out from from_word, or None if over max_steps """
+    seen = set([from_word])
+    frontier = [from_word]
+    for steps in range(max_steps + 1):
+        if to_word in seen:
+            return steps
+        next_frontier = []
+        for word in frontier:
+            for step in graph.neighbours(word) + (graph.anagrams(word) if with_anagrams else []):
+                if step not in seen:
+                    seen.add(step)
+                    next_frontier.append(step)
+        frontier = next_frontier
+    return None
+
+def check_ladder(steps=300, seed=0, path="9C.txt", max_steps=4):
+    """ sampled valid things comparing WordGraph.neighbours and anagrams with looking through every valid
+    thing, and WordGraph.ladder with a plain breadth first search: (questions checked, mismatches)
+
+    Looking through every valid thing is slow (a tenth of a second a
+    word), so only one word is tried for every ten steps; its ladder goes
+    half the time to a word a short random walk away, and otherwise to
+    another of the words tried. """
+    rng = random.Random(seed)
+    dictionary = Dictionary(path)
+    graph = dictionary.word_graph
+    by_length = dict()
+    for word in dictionary.words:
+        by_length.setdefault(len(word), []).append(word)
+    mismatches = []
+    checked = 0
+    samples = _sample_words(dictionary, max(1, steps // 10), rng)
+    for word in samples:
+        expected = sorted(other for length in (len(word) - 1, len(word), len(word) + 1)
+                          for other in by_length.get(length, []) if _one_letter_apart_p(word, other))
+        if graph.neighbours(word) != expected:
+            mismatches.append("neighbours(%r) is %r but %r are one letter apart" % (word, graph.neighbours(word), expected))
+        expected = sorted(other for other in by_length[len(word)] if other != word and sorted(other) == sorted(word))
+        if graph.anagrams(word) != expected:
+            mismatches.append("anagrams(%r) is %r but %r are anagrams" % (word, graph.anagrams(word), expected))
+        checked += 2
+    for from_word in samples:
+        with_anagrams = rng.random() < 0.5
+        if rng.random() < 0.5:
+            to_word = from_word
+            for i in range(rng.randrange(1, max_steps + 1)):
+                choices = graph.neighbours(to_word) + (graph.anagrams(to_word) if with_anagrams else [])
+                if choices:
+                    to_word = rng.choice(choices)
+        else:
+            to_word = rng.choice(samples)
+        expected = _ladder_length(graph, from_word, to_word, with_anagrams, max_steps)
+        chain = graph.ladder(from_word, to_word, with_anagrams, max_steps)
+        checked += 1
+        question = "ladder(%r, %r, with_anagrams=%s, max_steps=%s)" % (from_word, to_word, with_anagrams, max_steps)
+        if chain is None or expected is None:
+            if chain != expected:
+                mismatches.append("%s is %r but the shortest is %s steps" % (question, chain, expected))
+            continue
+        if len(chain) - 1 != expected:
+            mismatches.append("%s is %r, %s steps, but the shortest is %s" % (question, chain, len(chain) - 1, expected))
+        if chain[0] != from_word or chain[-1] != to_word or len(set(chain)) != len(chain):
+            mismatches.append("%s is %r, which does not go from one to the other" % (question, chain))
+        for a, b in zip(chain, chain[1:]):
+            if b not in dictionary.words or not (_one_letter_apart_p(a, b) or with_anagrams and sorted(a) == sorted(b)):
+                mismatches.append("%s is %r, but %s to %s is not a step" % (question, chain, a, b))
+    return checked, mismatches
+
+CHECKS = {"legal": check_legal, "hidden": check_hidden, "near": check_near, "ladder": check_ladder}
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check the fast paths against the slow ones they stand in for, e.g. legal_p against actually "
+        "carrying out each command")
+    parser.add_argument("checks", nargs="*", default=sorted(CHECKS), help="which checks (default: all of %s)"
+                        % ", ".join(sorted(CHECKS)))
+    parser.add_argument("--steps", type=int, default=300, help="steps of each random walk (default: 300)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed (default: 0)")
+    args = parser.parse_args()
+
+    failed = False
+    for name in args.checks:
+        if name not in CHECKS:
+            print("ERROR: no check called %s" % name)
+            failed = True
+            continue
+        checked, mismatches = CHECKS[name](steps=args.steps, seed=args.seed)
+        for mismatch in mismatches[:20]:
+            print("ERROR: %s" % mismatch)
+        print("%s: %s checked, %s mismatched" % (name, checked, len(mismatches)))
+        failed = failed or bool(mismatches)
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
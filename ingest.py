@@ -0,0 +1,735 @@
+#!/usr/bin/env python3
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import pickle
+import re
+import sys
+import zlib
+
+from zodiacquest import World, WorldMap, cache_path, write_cache
+
+class Ref:
+    """ an indirect reference (N G R) to an object of the PDF """
+
+    __slots__ = ("number",)
+
+    def __init__(self, number):
+        self.number = number
+
+    def __repr__(self):
+        return "%s 0 R" % self.number
+
+class Name(str):
+    """ a PDF name (/Font), kept apart from strings """
+
+class Stream:
+    __slots__ = ("dict", "raw")
+
+    def __init__(self, dictionary, raw):
+        self.dict = dictionary
+        self.raw = raw
+
+    @property
+    def data(self):
+        """ the stream's bytes, decoded (only FlateDecode is needed by the quest) """
+        filters = self.dict.get("Filter", [])
+        filters = filters if isinstance(filters, list) else [filters]
+        data = self.raw
+        for name in filters:
+            if name != "FlateDecode":
+                raise ValueError("unsupported stream filter %s" % name)
+            data = zlib.decompressobj().decompress(data)
+        return data
+
+_WHITESPACE = b" \t\r\n\f\0"
+_DELIMITERS = b"()<>[]{}/%"
+_TOKEN = re.compile(rb"[^ \t\r\n\f\0()<>\[\]{}/%]+")
+_ESCAPES = {ord("n"): b"\n", ord("r"): b"\r", ord("t"): b"\t", ord("b"): b"\b", ord("f"): b"\f"}
+
+class Lexer:
+    """ PDF objects and content stream operators, one at a time, from a buffer
+
+    next() returns the next object (numbers, strings as bytes, Name,
+    Ref, list, dict, True/False/None) or, for a bare word such as an
+    operator, a plain str. """
+
+    def __init__(self, data, pos=0):
+        self.data = data
+        self.pos = pos
+
+    def _skip(self):
+        data = self.data
+        while self.pos < len(data):
+            c = data[self.pos]
+            if c in _WHITESPACE:
+                self.pos += 1
+            elif c == ord("%"):
+                while self.pos < len(data) and data[self.pos] not in b"\r\n":
+                    self.pos += 1
+            else:
+                break
+
+    def at_end(self):
+        self._skip()
+        return self.pos >= len(self.data)
+
+    def next(self):
+        self._skip()
+        data = self.data
+        c = data[self.pos:self.pos + 1]
+        if c == b"/":
+            match = _TOKEN.match(data, self.pos + 1)
+            self.pos = match.end() if match else self.pos + 1
+            return Name(re.sub(rb"#([0-9A-Fa-f]{2})", lambda m: bytes([int(m.group(1), 16)]),
+                               match.group() if match else b"").decode("latin-1"))
+        if c == b"(":
+            return self._string()
+        if data[self.pos:self.pos + 2] == b"<<":
+            self.pos += 2
+            dictionary = dict()
+            while True:
+                self._skip()
+                if data[self.pos:self.pos + 2] == b">>":
+                    self.pos += 2
+                    return dictionary
+                key = self.next()
+                dictionary[key] = self.next()
+        if c == b"<":
+            end = data.index(b">", self.pos)
+            hex_digits = re.sub(rb"\s", b"", data[self.pos + 1:end])
+            self.pos = end + 1
+            return bytes.fromhex((hex_digits + b"0" * (len(hex_digits) % 2)).decode("ascii"))
+        if c == b"[":
+            self.pos += 1
+            items = []
+            while True:
+                self._skip()
+                if data[self.pos:self.pos + 1] == b"]":
+                    self.pos += 1
+                    return items
+                items.append(self.next())
+        if c in (b"]", b">", b"{", b"}", b")"):
+            self.pos += 1
+            return c.decode("latin-1")
+        match = _TOKEN.match(data, self.pos)
+        self.pos = match.end()
+        word = match.group().decode("latin-1")
+        if re.match(r"^[+-]?(\d+\.?\d*|\.\d+)$", word):
+            number = float(word) if "." in word else int(word)
+            if isinstance(number, int):
+                # N G R is a reference; anything else leaves the number alone
+                saved = self.pos
+                ref = re.compile(rb"\s+(\d+)\s+R(?![^ \t\r\n\f\0()<>\[\]{}/%])").match(data, self.pos)
+                if ref:
+                    self.pos = ref.end()
+                    return Ref(number)
+                self.pos = saved
+            return number
+        return {"true": True, "false": False, "null": None}.get(word, word)
+
+    def _string(self):
+        data = self.data
+        self.pos += 1
+        depth = 1
+        out = bytearray()
+        while True:
+            c = data[self.pos]
+            self.pos += 1
+            if c == ord("\\"):
+                escaped = data[self.pos]
+                self.pos += 1
+                if escaped in _ESCAPES:
+                    out += _ESCAPES[escaped]
+                elif ord("0") <= escaped <= ord("7"):
+                    digits = data[self.pos - 1:self.pos + 2]
+                    octal = re.match(rb"[0-7]{1,3}", digits).group()
+                    self.pos += len(octal) - 1
+                    out.append(int(octal, 8) & 0xFF)
+                elif escaped in b"\r\n":
+                    # a line continuation
+                    if escaped == ord("\r") and data[self.pos:self.pos + 1] == b"\n":
+                        self.pos += 1
+                else:
+                    out.append(escaped)
+            elif c == ord("("):
+                depth += 1
+                out.append(c)
+            elif c == ord(")"):
+                depth -= 1
+                if not depth:
+                    return bytes(out)
+                out.append(c)
+            else:
+                out.append(c)
+
+class PdfFile:
+    """ just enough of a PDF reader to stream the text of the quest's pages
+
+    Objects are found by scanning for "N G obj" rather than through the
+    cross-reference table (later definitions win, as with incremental
+    updates) and parsed only when asked for. """
+
+    _OBJECT = re.compile(rb"(?<![0-9])(\d+)\s+(\d+)\s+obj\b")
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            # mapped rather than read, so only the parts of the file the pages use get paged in
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._offsets = dict()
+        for match in self._OBJECT.finditer(self.data):
+            self._offsets[int(match.group(1))] = match.end()
+        self._objects = dict()
+
+    def get(self, number):
+        """ object number, parsed (a Stream for stream objects) """
+        if number not in self._objects:
+            lexer = Lexer(self.data, self._offsets[number])
+            value = lexer.next()
+            lexer._skip()
+            if isinstance(value, dict) and self.data[lexer.pos:lexer.pos + 6] == b"stream":
+                start = lexer.pos + len(b"stream")
+                start += 2 if self.data[start:start + 2] == b"\r\n" else 1
+                length = self.resolve(value.get("Length"))
+                if not isinstance(length, int) or self.data[start + length:start + length + 30].find(b"endstream") < 0:
+                    length = self.data.index(b"endstream", start) - start
+                value = Stream(value, self.data[start:start + length])
+            self._objects[number] = value
+        return self._objects[number]
+
+    def resolve(self, value):
+        while isinstance(value, Ref):
+            value = self.get(value.number)
+        return value
+
+    @property
+    def catalog(self):
+        for number in self._offsets:
+            value = self.get(number)
+            if isinstance(value, dict) and value.get("Type") == "Catalog":
+                return value
+        raise ValueError("no catalog")
+
+    def pages(self):
+        """ each page dictionary in order, following the page tree """
+        stack = [self.resolve(self.catalog["Pages"])]
+        while stack:
+            node = stack.pop()
+            if node.get("Type") == "Pages":
+                stack.extend(reversed([self.resolve(kid) for kid in node["Kids"]]))
+            else:
+                yield node
+
+    def page_contents(self, page):
+        """ the decoded content stream(s) of page, joined """
+        contents = self.resolve(page.get("Contents"))
+        contents = contents if isinstance(contents, list) else [contents]
+        return b"\n".join(self.resolve(stream).data for stream in contents if stream is not None)
+
+class Font:
+    """ turns the bytes of a shown string into text, through the font's ToUnicode map if it has one """
+
+    def __init__(self, pdf, font):
+        self._map = dict()
+        self._code_bytes = 2 if font.get("Subtype") == "Type0" else 1
+        to_unicode = pdf.resolve(font.get("ToUnicode"))
+        if isinstance(to_unicode, Stream):
+            self._read_cmap(to_unicode.data)
+
+    def _read_cmap(self, data):
+        lexer = Lexer(data)
+        section = None
+        operands = []
+        while not lexer.at_end():
+            token = lexer.next()
+            if token in ("beginbfchar", "beginbfrange", "begincodespacerange"):
+                section, operands = token, []
+            elif token in ("endbfchar", "endbfrange", "endcodespacerange"):
+                if section == "begincodespacerange" and operands:
+                    self._code_bytes = len(operands[0])
+                elif section == "beginbfchar":
+                    for code, text in zip(operands[0::2], operands[1::2]):
+                        self._map[int.from_bytes(code, "big")] = text.decode("utf-16-be", "replace")
+                elif section == "beginbfrange":
+                    for low, high, text in zip(operands[0::3], operands[1::3], operands[2::3]):
+                        low, high = int.from_bytes(low, "big"), int.from_bytes(high, "big")
+                        for i, code in enumerate(range(low, high + 1)):
+                            if isinstance(text, list):
+                                self._map[code] = text[i].decode("utf-16-be", "replace")
+                            else:
+                                first = int.from_bytes(text, "big") + i
+                                self._map[code] = first.to_bytes(len(text), "big").decode("utf-16-be", "replace")
+                section = None
+            elif section is not None:
+                operands.append(token)
+
+    def decode(self, data):
+        if not self._map:
+            return data.decode("cp1252", "replace")
+        n = self._code_bytes
+        return "".join(self._map.get(int.from_bytes(data[i:i + n], "big"), "")
+                       for i in range(0, len(data), n))
+
+class TextRun:
+    """ a piece of text shown at (x, y) on a page, in points from the bottom left """
+
+    __slots__ = ("x", "y", "size", "text")
+
+    def __init__(self, x, y, size, text):
+        self.x = x
+        self.y = y
+        self.size = size
+        self.text = text
+
+    def __repr__(self):
+        return "TextRun(%.1f, %.1f, %r)" % (self.x, self.y, self.text)
+
+class Shape:
+    """ the bounding box of a stroked path on a page, and how many corners it was drawn with """
+
+    __slots__ = ("x0", "y0", "x1", "y1", "corners", "rectangle")
+
+    def __init__(self, points, rectangle):
+        xs = [x for x, y in points]
+        ys = [y for x, y in points]
+        self.x0, self.y0, self.x1, self.y1 = min(xs), min(ys), max(xs), max(ys)
+        self.corners = len(points)
+        self.rectangle = rectangle
+
+    def __repr__(self):
+        return "Shape(%.1f, %.1f, %.1f, %.1f, %s)" % (self.x0, self.y0, self.x1, self.y1, self.corners)
+
+    def contains(self, x, y, margin=0):
+        return self.x0 - margin <= x <= self.x1 + margin and self.y0 - margin <= y <= self.y1 + margin
+
+    def overlaps(self, other, margin=0):
+        return (self.x0 - margin <= other.x1 and other.x0 <= self.x1 + margin and
+                self.y0 - margin <= other.y1 and other.y0 <= self.y1 + margin)
+
+def _multiply(m, n):
+    a, b, c, d, e, f = m
+    a2, b2, c2, d2, e2, f2 = n
+    return [a * a2 + b * c2, a * b2 + b * d2, c * a2 + d * c2, c * b2 + d * d2,
+            e * a2 + f * c2 + e2, e * b2 + f * d2 + f2]
+
+def _transform(ctm, x, y):
+    a, b, c, d, e, f = ctm
+    return (a * x + c * y + e, b * x + d * y + f)
+
+_STROKES = frozenset(("S", "s", "B", "B*", "b", "b*"))
+_PAINTS = frozenset(("f", "F", "f*", "n")) | _STROKES
+
+def page_marks(pdf, contents, resources, ctm=(1, 0, 0, 1, 0, 0), depth=0):
+    """ the TextRuns and stroked Shapes a content stream draws, including those of any form XObjects
+
+    Follows just the operators that place text and outlines: the
+    graphics state stack (q, Q, cm), text objects and positioning (BT,
+    Tm, Td, TD, T*, TL), fonts (Tf), showing text (Tj, TJ, ', "), and
+    path construction and painting (m, l, c, v, y, h, re, then S, f and
+    friends). Widths are not known, so a run's x is where it starts;
+    curves count only their end points. """
+    fonts = dict()
+    font_dicts = pdf.resolve(pdf.resolve(resources or {}).get("Font", {}))
+    xobjects = pdf.resolve(pdf.resolve(resources or {}).get("XObject", {}))
+    runs = []
+    shapes = []
+    lexer = Lexer(contents)
+    operands = []
+    ctm = list(ctm)
+    stack = []
+    tm = line = [1, 0, 0, 1, 0, 0]
+    leading = 0
+    font = None
+    size = 0
+    path = []
+    rectangle = False
+    while not lexer.at_end():
+        token = lexer.next()
+        if not isinstance(token, str) or isinstance(token, Name):
+            operands.append(token)
+            continue
+        if token == "BI":
+            # skip inline image data
+            end = contents.find(b"EI", lexer.pos)
+            lexer.pos = len(contents) if end < 0 else end + 2
+        elif token == "q":
+            stack.append(ctm)
+        elif token == "Q":
+            ctm = stack.pop() if stack else ctm
+        elif token == "cm" and len(operands) >= 6:
+            ctm = _multiply(operands[-6:], ctm)
+        elif token in ("m", "l") and len(operands) >= 2:
+            if token == "m" and path:
+                # a new subpath: only the latest one is kept as the shape
+                path, rectangle = [], False
+            path.append(_transform(ctm, operands[-2], operands[-1]))
+        elif token in ("c", "v", "y") and len(operands) >= 4:
+            path.append(_transform(ctm, operands[-2], operands[-1]))
+        elif token == "re" and len(operands) >= 4:
+            x, y, w, h = operands[-4:]
+            path = [_transform(ctm, x, y), _transform(ctm, x + w, y),
+                    _transform(ctm, x + w, y + h), _transform(ctm, x, y + h)]
+            rectangle = True
+        elif token in _PAINTS:
+            if token in _STROKES and path:
+                shapes.append(Shape(path, rectangle))
+            path, rectangle = [], False
+        elif token == "BT":
+            tm = line = [1, 0, 0, 1, 0, 0]
+        elif token == "Tm" and len(operands) >= 6:
+            tm = line = list(operands[-6:])
+        elif token in ("Td", "TD") and len(operands) >= 2:
+            if token == "TD":
+                leading = -operands[-1]
+            tm = line = _multiply([1, 0, 0, 1, operands[-2], operands[-1]], line)
+        elif token == "TL" and operands:
+            leading = operands[-1]
+        elif token in ("T*", "'", '"'):
+            tm = line = _multiply([1, 0, 0, 1, 0, -leading], line)
+        elif token == "Tf" and len(operands) >= 2:
+            name, size = operands[-2], operands[-1]
+            if name not in fonts:
+                fonts[name] = Font(pdf, pdf.resolve(font_dicts.get(name, {})))
+            font = fonts[name]
+        elif token == "Do" and operands and depth < 8:
+            xobject = pdf.resolve(xobjects.get(operands[-1]))
+            if isinstance(xobject, Stream) and xobject.dict.get("Subtype") == "Form":
+                matrix = xobject.dict.get("Matrix", [1, 0, 0, 1, 0, 0])
+                form_runs, form_shapes = page_marks(pdf, xobject.data, xobject.dict.get("Resources", resources),
+                                                    _multiply(matrix, ctm), depth + 1)
+                runs += form_runs
+                shapes += form_shapes
+        if token in ("Tj", "TJ", "'", '"') and operands and font is not None:
+            shown = operands[-1]
+            pieces = shown if isinstance(shown, list) else [shown]
+            text = "".join(font.decode(piece) for piece in pieces if isinstance(piece, bytes))
+            if text:
+                x, y = _multiply(tm, ctm)[4:]
+                runs.append(TextRun(x, y, size, text))
+        if token not in ("BI",):
+            operands = []
+    return runs, shapes
+
+def text_lines(runs, tolerance=2.0):
+    """ the runs grouped into lines (runs at about the same height), top to bottom, each left to right """
+    lines = []
+    for run in sorted(runs, key=lambda run: (-run.y, run.x)):
+        if lines and abs(lines[-1][0] - run.y) <= tolerance:
+            lines[-1][1].append(run)
+        else:
+            lines.append((run.y, [run]))
+    return [sorted(line_runs, key=lambda run: run.x) for y, line_runs in lines]
+
+# bump when extract_page changes, so cached pages are redone
+EXTRACT_VERSION = 1
+# how close (in points) a portal must come to the paper's edge to lead onto the next map page
+EDGE = 15
+# the map pages are laid out two to a row: 1 2 over 3 4
+MAP_COLUMNS = 2
+
+_REGION_NAME = re.compile(r"^[A-Z][A-Z '\-]*[A-Z]$")
+_CLARITY_NOTE = re.compile(r"this Region connects to (.+?) to the \w+ by an? (\d+)-Coin Portal")
+_PERSON = re.compile(r"I am the ([A-Z][a-z]+)\b")
+
+def page_key(pdf, page):
+    """ content hash of what page draws: its content streams, any XObjects it uses, and its size """
+    digest = hashlib.sha256(b"%d\0" % EXTRACT_VERSION)
+    digest.update(repr(page.get("MediaBox")).encode())
+    digest.update(pdf.page_contents(page))
+    resources = pdf.resolve(page.get("Resources") or {})
+    xobjects = pdf.resolve(resources.get("XObject", {}))
+    for name in sorted(xobjects):
+        xobject = pdf.resolve(xobjects[name])
+        if isinstance(xobject, Stream):
+            digest.update(xobject.raw)
+    return digest.hexdigest()
+
+def _text(runs):
+    return re.sub(r"\s+", " ", " ".join("".join(run.text for run in line) for line in text_lines(runs))).strip()
+
+def extract_page(pdf, page):
+    """ what one page says about the map, in terms of that page alone
+
+    Regions are the outlined boxes headed by an uppercase name. Portals
+    are the outlined diamonds, costing the digit inside: one touching
+    two boxes joins them, and one touching a single box at the edge of
+    the paper goes to the next page over, which assemble() works out.
+    "FOR CLARITY" notes name portals that only meet at a corner, and
+    people introduce themselves with "I am the ...". Returns a dict of
+    plain values, ready to be cached. """
+    runs, shapes = page_marks(pdf, pdf.page_contents(page), page.get("Resources"))
+    x0, y0, width, height = [float(value) for value in pdf.resolve(page.get("MediaBox", [0, 0, 612, 792]))]
+    regions = []
+    boxes = []
+    for shape in shapes:
+        if not shape.rectangle:
+            continue
+        inside = [run for run in runs if shape.contains(run.x, run.y)]
+        in_note = False
+        for line in text_lines(inside):
+            name = re.sub(r"\s+", " ", "".join(run.text for run in line)).strip()
+            # a [bracketed note] may come before the name
+            if in_note or name.startswith("["):
+                in_note = "]" not in name
+                continue
+            if re.search("[a-z]", name):
+                break
+            if _REGION_NAME.match(name):
+                regions.append({"name": name, "box": (shape.x0, shape.y0, shape.x1, shape.y1),
+                                "text": _text(inside)})
+                boxes.append(shape)
+                break
+    portals = []
+    crossings = []
+    digits = [run for run in runs if run.text.strip().isdigit()]
+    for shape in shapes:
+        if shape.rectangle or shape.corners < 3:
+            continue
+        # corrections are pasted over the original digit, so the one drawn last is the one that shows
+        costs = [int(run.text) for run in digits if shape.contains(run.x, run.y)]
+        touching = [region["name"] for region, box in zip(regions, boxes) if shape.overlaps(box, 2)]
+        if not costs or not touching:
+            continue
+        cost = costs[-1]
+        x, y = (shape.x0 + shape.x1) / 2, (shape.y0 + shape.y1) / 2
+        if len(touching) == 2:
+            portals.append({"between": touching, "cost": cost})
+        elif len(touching) == 1:
+            for edge, off_paper in [("right", shape.x1 >= width - EDGE), ("top", shape.y1 >= height - EDGE),
+                                    ("left", shape.x0 <= x0 + EDGE), ("bottom", shape.y0 <= y0 + EDGE)]:
+                if off_paper:
+                    crossings.append({"region": touching[0], "edge": edge, "at": (x, y), "cost": cost})
+                    break
+    notes = []
+    things = []
+    for region in regions:
+        for match in _CLARITY_NOTE.finditer(region["text"]):
+            notes.append({"between": [region["name"], match.group(1)], "cost": int(match.group(2))})
+        for match in _PERSON.finditer(region["text"]):
+            things.append({"region": region["name"], "type": "Person", "names": [match.group(1).upper()]})
+    for region in regions:
+        del region["text"]
+    return {"regions": regions, "portals": portals, "crossings": crossings, "notes": notes, "things": things}
+
+class PageCache:
+    """ extract_page results on disk, keyed by page_key, so only pages that changed are redone """
+
+    def __init__(self, pdf_path, enabled=True):
+        self.path = cache_path(pdf_path, ".pages")
+        self.enabled = enabled
+        self.pages = dict()
+        self.hits = self.misses = 0
+        if enabled:
+            try:
+                with open(self.path, 'rb') as f:
+                    self.pages = pickle.load(f)
+            except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+                pass
+        self._used = dict()
+
+    def get(self, pdf, page):
+        key = page_key(pdf, page)
+        if key in self.pages:
+            self.hits += 1
+            extracted = self.pages[key]
+        else:
+            self.misses += 1
+            extracted = extract_page(pdf, page)
+        self._used[key] = extracted
+        return extracted
+
+    def save(self):
+        """ keep just the pages seen this time, if anything was redone """
+        if self.enabled and (self.misses or len(self._used) != len(self.pages)):
+            write_cache(self.path, pickle.dumps(self._used, pickle.HIGHEST_PROTOCOL))
+
+def _across(edge, at, boxes):
+    """ of the boxes on the neighbouring page, the one a portal leaving by edge at (x, y) lands in """
+    x, y = at
+    if edge in ("left", "right"):
+        facing = [(name, box) for name, box in boxes if box[1] <= y <= box[3]]
+        pick = min if edge == "right" else max
+        return pick(facing, key=lambda item: item[1][0] if edge == "right" else item[1][2], default=(None,))[0]
+    facing = [(name, box) for name, box in boxes if box[0] <= x <= box[2]]
+    pick = min if edge == "top" else max
+    return pick(facing, key=lambda item: item[1][1] if edge == "top" else item[1][3], default=(None,))[0]
+
+_NEIGHBOUR = {"right": 1, "left": -1, "top": -MAP_COLUMNS, "bottom": MAP_COLUMNS}
+
+def assemble(map_pages, ids=None):
+    """ the declarative world (as world.json has it) from the extracted map pages, in order
+
+    The PDF has no region ids, so regions take theirs from ids (name ->
+    id, e.g. an existing world file) where it has them and the next
+    free letter otherwise. Returns (definition, problems). """
+    ids = dict(ids or {})
+    problems = []
+    regions = []
+    page_of = dict()
+    for number, extracted in enumerate(map_pages, 1):
+        for region in extracted["regions"]:
+            if region["name"] in page_of:
+                problems.append("region %s appears on pages %s and %s" % (region["name"], page_of[region["name"]], number))
+                continue
+            page_of[region["name"]] = number
+            regions.append(region["name"])
+    free = (chr(c) for c in range(ord("A"), ord("Z") + 1) if chr(c) not in ids.values())
+    for name in regions:
+        if name not in ids:
+            ids[name] = next(free, name)
+    portals = []
+    seen = dict()
+
+    def add(a, b, cost, page):
+        if a not in page_of or b not in page_of:
+            problems.append("page %s: portal to unknown region %s" % (page, b if a in page_of else a))
+            return
+        pair = frozenset((a, b))
+        if pair in seen:
+            if seen[pair]["cost"] != cost:
+                problems.append("page %s: %s-%s costs %s here but %s on page %s"
+                                % (page, a, b, cost, seen[pair]["cost"], seen[pair]["page"]))
+            return
+        seen[pair] = {"between": [ids[a], ids[b]], "cost": cost, "page": page}
+        portals.append(seen[pair])
+
+    for number, extracted in enumerate(map_pages, 1):
+        for portal in extracted["portals"]:
+            add(portal["between"][0], portal["between"][1], portal["cost"], number)
+        for crossing in extracted["crossings"]:
+            neighbour = number - 1 + _NEIGHBOUR[crossing["edge"]]
+            same_row = crossing["edge"] in ("top", "bottom") or neighbour // MAP_COLUMNS == (number - 1) // MAP_COLUMNS
+            if not (0 <= neighbour < len(map_pages) and same_row):
+                problems.append("page %s: portal from %s leads off the map" % (number, crossing["region"]))
+                continue
+            boxes = [(region["name"], region["box"]) for region in map_pages[neighbour]["regions"]]
+            other = _across(crossing["edge"], crossing["at"], boxes)
+            if other is None:
+                problems.append("page %s: portal from %s lands in no region on page %s"
+                                % (number, crossing["region"], neighbour + 1))
+                continue
+            add(crossing["region"], other, crossing["cost"], number)
+        for note in extracted["notes"]:
+            add(note["between"][0], note["between"][1], note["cost"], number)
+    things = []
+    for extracted in map_pages:
+        for thing in extracted["things"]:
+            thing = dict(thing, region=ids[thing["region"]])
+            magic = "%s_magic" % thing["names"][0].lower()
+            if hasattr(World, magic):
+                thing["magic"] = magic
+            things.append(thing)
+    definition = {
+        "regions": [{"id": ids[name], "name": name, "page": page_of[name], "monument": None} for name in regions],
+        "portals": portals,
+        "things": things,
+    }
+    return definition, problems
+
+def ingest(pdf_path, ids=None, use_cache=True):
+    """ (definition, problems, cache) for the PDF at pdf_path, a page at a time """
+    pdf = PdfFile(pdf_path)
+    cache = PageCache(pdf_path, use_cache)
+    map_pages = []
+    for page in pdf.pages():
+        extracted = cache.get(pdf, page)
+        # the introduction pages have no regions on them
+        if extracted["regions"]:
+            map_pages.append(extracted)
+    cache.save()
+    definition, problems = assemble(map_pages, ids)
+    return definition, problems, cache
+
+def compare(definition, world_map):
+    """ how the extracted definition differs from world_map, as (graph differences, thing differences)
+
+    Regions are matched by name, since the ids are not in the PDF. """
+    extracted = WorldMap(definition)
+    graph = []
+    names = set(extracted.names)
+    for name in world_map.names:
+        if name not in names:
+            graph.append("region %s is missing" % name)
+    for i, name in enumerate(extracted.names):
+        if name not in world_map.index:
+            graph.append("region %s is not in the map" % name)
+        elif world_map.pages[world_map.index[name]] != extracted.pages[i]:
+            graph.append("region %s is on page %s, not %s" % (name, extracted.pages[i], world_map.pages[world_map.index[name]]))
+
+    def portals_of(m):
+        return {frozenset((m.names[a], m.names[b])): cost
+                for a, b, cost in zip(m.portal_a, m.portal_b, m.portal_costs)}
+
+    expected = portals_of(world_map)
+    found = portals_of(extracted)
+    for pair in sorted(set(expected) | set(found), key=sorted):
+        label = "-".join(sorted(pair))
+        if pair not in found:
+            graph.append("portal %s (%s) is missing" % (label, expected[pair]))
+        elif pair not in expected:
+            graph.append("portal %s (%s) is not in the map" % (label, found[pair]))
+        elif found[pair] != expected[pair]:
+            graph.append("portal %s costs %s, not %s" % (label, found[pair], expected[pair]))
+
+    def things_of(m):
+        return {(m.names[m.index[thing["region"]]], thing["names"][0]) for thing in m.things}
+
+    things = ["thing %s in %s is missing" % (name, region)
+              for region, name in sorted(things_of(world_map) - things_of(extracted))]
+    things += ["thing %s in %s is not in the map" % (name, region)
+               for region, name in sorted(things_of(extracted) - things_of(world_map))]
+    return graph, things
+
+def format_world(definition):
+    """ definition as JSON laid out like world.json, an entry a line """
+    sections = []
+    for key in ("regions", "portals", "things"):
+        entries = ",\n".join("    " + json.dumps(entry, ensure_ascii=False) for entry in definition[key])
+        sections.append('  "%s": [\n%s\n  ]' % (key, entries))
+    return "{\n" + ",\n".join(sections) + "\n}\n"
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Extract the world (regions, portals and things) from the quest's PDF, a page at a time, "
+        "caching each page by content hash so only changed pages are reprocessed")
+    parser.add_argument("pdf", nargs="?", default="zodiacquest.pdf", help="the quest (default: zodiacquest.pdf)")
+    parser.add_argument("--output", help="write the extracted world here (default: stdout, unless checking)")
+    parser.add_argument("--check", metavar="MAP_FILE",
+                        help="compare against this world file, and take region ids from it; exits 1 if the graph differs "
+                        "(without it, ids come from world.json if there is one)")
+    parser.add_argument("--no-cache", action="store_true", help="reprocess every page, and leave the page cache alone")
+    args = parser.parse_args()
+
+    world_map = WorldMap.load(args.check) if args.check else None
+    # the PDF has no ids, and handing them out in drawing order would re-letter the map
+    ids_map = world_map or (WorldMap.load("world.json") if os.path.exists("world.json") else None)
+    if ids_map is None and args.output and os.path.exists(args.output):
+        print("ERROR: no world.json to take region ids from, so not overwriting %s" % args.output)
+        sys.exit(1)
+    ids = dict(zip(ids_map.names, ids_map.ids)) if ids_map else None
+    definition, problems, cache = ingest(args.pdf, ids, not args.no_cache)
+    for problem in problems:
+        print("ERROR: %s" % problem, file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(format_world(definition))
+    elif not args.check:
+        sys.stdout.write(format_world(definition))
+    print("%s pages: %s from cache, %s reprocessed; %s regions, %s portals, %s things"
+          % (cache.hits + cache.misses, cache.hits, cache.misses, len(definition["regions"]),
+             len(definition["portals"]), len(definition["things"])), file=sys.stderr)
+    if world_map is None:
+        return
+    graph, things = compare(definition, world_map)
+    for difference in graph:
+        print("ERROR: %s" % difference)
+    for difference in things:
+        print("NOTE: %s" % difference)
+    if graph or problems:
+        sys.exit(1)
+    print("the extracted graph matches %s" % args.check)
+
+if __name__ == "__main__":
+    main()
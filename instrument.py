@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+import argparse
+import cProfile
+import json
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import zodiacquest
+from batch import read_files, run_batch
+from zodiacquest import World, You, Portal, Inventory, TurnView
+
+# (operation, class, attribute) for every hot path that can be instrumented
+HOT_PATHS = [
+    ("World.__init__", World, "__init__"),
+    ("You.command", You, "command"),
+    ("Portal.transit", Portal, "transit"),
+    ("Portal.cost", Portal, "cost"),
+    # TurnView prices every portal it shows through cost_with_gem, without going through cost
+    ("Portal.cost_with_gem", Portal, "cost_with_gem"),
+    ("Inventory.add", Inventory, "add"),
+    ("Inventory.get", Inventory, "get"),
+    ("Inventory.remove", Inventory, "remove"),
+    ("Inventory.things", Inventory, "things"),
+    ("Inventory.have_gem_p", Inventory, "have_gem_p"),
+    ("TurnView.description", TurnView, "_derive_description"),
+    ("TurnView.commands", TurnView, "_derive_commands"),
+]
+
+class Histogram:
+    """ call count and latencies of one operation, bucketed by powers of two nanoseconds """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.buckets = [0] * 48
+
+    def add(self, ns):
+        self.count += 1
+        self.total += ns
+        if ns > self.max:
+            self.max = ns
+        self.buckets[min(ns.bit_length(), len(self.buckets) - 1)] += 1
+
+    def percentile(self, fraction):
+        """ upper bound (ns) of the bucket holding the given fraction of calls """
+        seen = 0
+        for bit_length, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= fraction * self.count:
+                return min(1 << bit_length, self.max)
+        return 0
+
+    @property
+    def record(self):
+        return {
+            "count": self.count,
+            "total_ms": self.total / 1e6,
+            "mean_us": self.total / self.count / 1e3 if self.count else 0,
+            "p50_us": self.percentile(0.5) / 1e3,
+            "p99_us": self.percentile(0.99) / 1e3,
+            "max_us": self.max / 1e3,
+            "buckets": dict(("<%sns" % (1 << bit_length), n) for bit_length, n in enumerate(self.buckets) if n),
+        }
+
+class Instrumentation:
+    """ per-operation counters and latency histograms for the game's hot paths
+
+    Nothing is touched until install(), which swaps timing wrappers
+    into the classes; uninstall() puts the originals back, so a game
+    that is not instrumented pays nothing at all. Use it as a context
+    manager to do both. Nested calls (e.g. Inventory.get inside
+    You.command) are timed separately, each including its callees. """
+
+    def __init__(self, hot_paths=HOT_PATHS):
+        self._hot_paths = hot_paths
+        self._originals = []
+        self.histograms = dict((operation, Histogram()) for operation, cls, attribute in hot_paths)
+
+    def _timed(self, fn, histogram):
+        clock = time.perf_counter_ns
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                histogram.add(clock() - start)
+        timed.__name__ = fn.__name__
+        timed.__doc__ = fn.__doc__
+        return timed
+
+    def install(self):
+        if self._originals:
+            return self
+        for operation, cls, attribute in self._hot_paths:
+            original = cls.__dict__[attribute]
+            histogram = self.histograms[operation]
+            if isinstance(original, property):
+                wrapper = property(self._timed(original.fget, histogram), doc=original.__doc__)
+            else:
+                wrapper = self._timed(original, histogram)
+            self._originals.append((cls, attribute, original))
+            setattr(cls, attribute, wrapper)
+        return self
+
+    def uninstall(self):
+        for cls, attribute, original in reversed(self._originals):
+            setattr(cls, attribute, original)
+        self._originals = []
+
+    def __enter__(self):
+        return self.install()
+
+    def __exit__(self, *exc_info):
+        self.uninstall()
+
+    @property
+    def record(self):
+        return dict((operation, histogram.record) for operation, histogram in self.histograms.items())
+
+    def report(self):
+        """ the counters and latencies as a text table """
+        lines = ["%-22s %9s %11s %10s %10s %10s %10s" % (
+            "operation", "calls", "total ms", "mean us", "p50 us", "p99 us", "max us")]
+        for operation, histogram in sorted(self.histograms.items(), key=lambda item: -item[1].total):
+            if histogram.count:
+                record = histogram.record
+                lines.append("%-22s %9d %11.3f %10.2f %10.2f %10.2f %10.2f" % (
+                    operation, record["count"], record["total_ms"], record["mean_us"],
+                    record["p50_us"], record["p99_us"], record["max_us"]))
+        return "\n".join(lines)
+
+    def dump(self, path):
+        """ write the report to path: JSON if it ends in .json, otherwise text """
+        with open(path, 'w') as f:
+            if path.endswith(".json"):
+                json.dump(self.record, f, indent=1)
+            else:
+                f.write(self.report() + "\n")
+
+@contextmanager
+def profiled(cprofile_path=None, tracemalloc_path=None, top=25):
+    """ run the body under cProfile and/or tracemalloc, writing what they found to the given files
+
+    cprofile_path gets pstats data (read it with python -m pstats);
+    tracemalloc_path gets the allocation sites holding the most memory
+    at the end, plus the peak. """
+    profile = cProfile.Profile() if cprofile_path else None
+    if tracemalloc_path:
+        tracemalloc.start()
+    if profile is not None:
+        profile.enable()
+    try:
+        yield
+    finally:
+        if profile is not None:
+            profile.disable()
+            profile.dump_stats(cprofile_path)
+        if tracemalloc_path:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            with open(tracemalloc_path, 'w') as f:
+                f.write("traced memory: %.1fKB now, %.1fKB peak\n" % (current / 1024, peak / 1024))
+                for stat in snapshot.statistics("lineno")[:top]:
+                    f.write("%s\n" % stat)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Play (or replay command scripts) with the hot paths instrumented, reporting when the session quits")
+    parser.add_argument("scripts", nargs="*", help="replay these command scripts instead of playing interactively")
+    parser.add_argument("--report", default=None,
+                        help="write the counters and latencies here (.json for JSON, otherwise text; default: stderr)")
+    parser.add_argument("--cprofile", default=None, help="also run under cProfile, writing pstats data here")
+    parser.add_argument("--tracemalloc", default=None, help="also trace allocations, writing the top sites here")
+    args = parser.parse_args()
+
+    instrumentation = Instrumentation()
+    try:
+        with instrumentation, profiled(args.cprofile, args.tracemalloc):
+            if args.scripts:
+                for record in run_batch(read_files(args.scripts)):
+                    print(json.dumps(record, separators=(",", ":")))
+            else:
+                zodiacquest.main()
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        if args.report:
+            instrumentation.dump(args.report)
+        else:
+            sys.stderr.write(instrumentation.report() + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+import argparse
+import time
+
+from zodiacquest import Dictionary
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Word ladders and anagrams over the valid things: the shortest chain between two things, "
+        "or the neighbours and anagrams of one")
+    parser.add_argument("things", nargs="+", help="one thing, or two to chain between")
+    parser.add_argument("--anagrams", action="store_true", help="let a chain step to an anagram as well")
+    parser.add_argument("--max-steps", type=int, default=None, help="give up on chains longer than this")
+    parser.add_argument("--dictionary", default="9C.txt", help="valid things dictionary (default: 9C.txt)")
+    args = parser.parse_args()
+
+    dictionary = Dictionary(args.dictionary)
+    things = [thing.upper() for thing in args.things]
+    for thing in things:
+        if thing not in dictionary.words:
+            print("ERROR: %s is not a valid thing" % thing)
+    graph = dictionary.word_graph
+    start_time = time.perf_counter()
+    if len(things) == 1:
+        print("neighbours: %s" % ", ".join(graph.neighbours(things[0])))
+        print("anagrams: %s" % ", ".join(graph.anagrams(things[0])))
+    else:
+        for from_thing, to_thing in zip(things, things[1:]):
+            chain = graph.ladder(from_thing, to_thing, args.anagrams, args.max_steps)
+            if chain is None:
+                print("%s to %s: no chain" % (from_thing, to_thing))
+            else:
+                print("%s (%s step%s)" % (" -> ".join(chain), len(chain) - 1, "" if len(chain) == 2 else "s"))
+    print("%.2fms" % ((time.perf_counter() - start_time) * 1e3))
+
+if __name__ == "__main__":
+    main()
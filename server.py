@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+import argparse
+import ast
+import asyncio
+import random
+import resource
+import time
+
+from zodiacquest import World, You, TextSink, GO_CMD
+
+PROMPT_END = b"> "
+
+class GameServer:
+    """ many players over a line protocol, all sharing one read-only World
+
+    Each connection gets its own You with copy-on-write region
+    inventories, so the map and dictionary are built once per process
+    and a player only copies the inventories they change. Every reply
+    ends with a "<step>> " prompt, like the terminal game. """
+
+    def __init__(self, world, start="A", coins=15):
+        self._world = world
+        self._start = start
+        self._coins = coins
+        self.sessions = 0
+        self.active_sessions = 0
+        self.peak_sessions = 0
+        self.commands = 0
+
+    def _prompt(self, you):
+        return "%s\nCommands: %s\n%s> " % (you.description, you.commands, you.step)
+
+    def _command(self, you, cmd):
+        try:
+            you.command(cmd)
+            error = ""
+        except Exception as e:
+            # a bad command should not take the connection down with it
+            error = "ERROR: could not carry out %s (%s: %s)\n" % (cmd, type(e).__name__, e)
+        self.commands += 1
+        return you.events.pop_text() + error
+
+    async def handle(self, reader, writer):
+        you = You(self._world.regions[self._start], coins=self._coins, copy_on_write=True, events=TextSink())
+        self.sessions += 1
+        self.active_sessions += 1
+        self.peak_sessions = max(self.peak_sessions, self.active_sessions)
+        try:
+            writer.write(("%s\n%s" % (self._world.description, self._prompt(you))).encode())
+            while not you.quit:
+                line = await reader.readline()
+                if not line:
+                    break
+                reply = self._command(you, line.decode(errors="replace").strip().upper())
+                if not you.quit:
+                    reply += self._prompt(you)
+                writer.write(reply.encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.active_sessions -= 1
+            writer.close()
+
+async def serve(host, port, world):
+    game_server = GameServer(world)
+    server = await asyncio.start_server(game_server.handle, host, port, backlog=1024)
+    print("Serving %s on %s" % (world.description, ", ".join(str(sock.getsockname()) for sock in server.sockets)))
+    async with server:
+        await server.serve_forever()
+
+def _go_commands(reply):
+    # pick the go commands out of the "Commands: [...]" line of a reply
+    for line in reply.splitlines():
+        if line.startswith("Commands: "):
+            return [cmd for cmd in ast.literal_eval(line[len("Commands: "):]) if cmd.startswith(GO_CMD)]
+    return []
+
+async def _player(host, port, n_commands, latencies, rng):
+    reader, writer = await asyncio.open_connection(host, port)
+    reply = (await reader.readuntil(PROMPT_END)).decode()
+    for _ in range(n_commands):
+        cmds = _go_commands(reply)
+        if not cmds:
+            break
+        start = time.perf_counter()
+        writer.write((rng.choice(cmds) + "\n").encode())
+        reply = (await reader.readuntil(PROMPT_END)).decode()
+        latencies.append(time.perf_counter() - start)
+    writer.write(b"Q\n")
+    await writer.drain()
+    await reader.read()
+    writer.close()
+
+async def load(host, port, n_sessions, n_commands, seed=None):
+    """ run n_sessions concurrent random walkers and report throughput and latency
+
+    With no host, a server is started in this process on a free
+    localhost port, so the report covers the server's own footprint. """
+    game_server = None
+    if host is None:
+        game_server = GameServer(World())
+        server = await asyncio.start_server(game_server.handle, "127.0.0.1", 0, backlog=max(100, n_sessions))
+        host, port = server.sockets[0].getsockname()[:2]
+    rng = random.Random(seed)
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*[_player(host, port, n_commands, latencies, random.Random(rng.random()))
+                           for _ in range(n_sessions)])
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    print("%s sessions, %s commands in %.2fs: %.0f commands/sec" % (
+        n_sessions, len(latencies), elapsed, len(latencies) / elapsed))
+    if latencies:
+        print("latency p50 %.2fms, p99 %.2fms, max %.2fms" % (
+            latencies[len(latencies) // 2] * 1e3, latencies[int(len(latencies) * 0.99)] * 1e3, latencies[-1] * 1e3))
+    if game_server is not None:
+        server.close()
+        await server.wait_closed()
+        print("server held up to %s concurrent sessions in one process (max RSS %.1fMB)" % (
+            game_server.peak_sessions, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve Zodiac Quest to many players over TCP, or load test a server")
+    parser.add_argument("--host", default=None, help="address to serve on (default: 127.0.0.1), or server to load test")
+    parser.add_argument("--port", type=int, default=7777)
+    parser.add_argument("--load", action="store_true",
+                        help="run the load generator (against --host, or an in-process server if not given)")
+    parser.add_argument("--sessions", type=int, default=200, help="concurrent load generator sessions")
+    parser.add_argument("--commands", type=int, default=50, help="commands per load generator session")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.load:
+        asyncio.run(load(args.host, args.port, args.sessions, args.commands, args.seed))
+    else:
+        asyncio.run(serve(args.host or "127.0.0.1", args.port, World()))
+
+if __name__ == "__main__":
+    main()
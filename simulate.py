@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import multiprocessing
+import time
+
+import numpy as np
+
+from zodiacquest import WorldMap, GEM_NAMES
+
+class WalkStats:
+    """ totals over many walks, which add up across chunks and processes """
+
+    def __init__(self, n_regions):
+        self.walkers = 0
+        self.reached = np.zeros(n_regions, dtype=np.int64)
+        self.steps_to_reach = np.zeros(n_regions, dtype=np.int64)
+        self.coins_on_arrival = np.zeros(n_regions, dtype=np.int64)
+        self.coins_left = 0
+        self.steps = 0
+        self.stranded = 0
+        self.with_gem = 0
+
+    def __iadd__(self, other):
+        self.walkers += other.walkers
+        self.reached += other.reached
+        self.steps_to_reach += other.steps_to_reach
+        self.coins_on_arrival += other.coins_on_arrival
+        self.coins_left += other.coins_left
+        self.steps += other.steps
+        self.stranded += other.stranded
+        self.with_gem += other.with_gem
+        return self
+
+    def record(self, world_map):
+        reached = np.maximum(self.reached, 1)
+        return {
+            "walkers": self.walkers,
+            "mean_coins_left": self.coins_left / self.walkers,
+            "mean_steps": self.steps / self.walkers,
+            "stranded": self.stranded / self.walkers,
+            "with_gem": self.with_gem / self.walkers,
+            "regions": dict((region_id, {
+                "reach_probability": float(self.reached[i] / self.walkers),
+                "mean_steps_to_reach": float(self.steps_to_reach[i] / reached[i]) if self.reached[i] else None,
+                "mean_coins_on_arrival": float(self.coins_on_arrival[i] / reached[i]) if self.reached[i] else None,
+            }) for i, region_id in enumerate(world_map.ids)),
+        }
+
+class Simulator:
+    """ random or policy-driven walks over the portal graph, a whole batch of walkers per numpy step
+
+    Each walker pays Portal.cost for every portal it goes through, 3
+    coins becoming 1 once it has a gem, and picks up a gem whenever it
+    arrives in a region holding one. A walk ends when no portal out is
+    affordable (stranded) or after max_steps.
+
+    Policies choose among the affordable portals: random picks any;
+    cheapest picks among the cheapest; unvisited prefers regions the
+    walker has not been to yet. """
+
+    POLICIES = ["random", "cheapest", "unvisited"]
+
+    def __init__(self, world_map, gem_regions=None):
+        self.map = world_map
+        n = world_map.n
+        if gem_regions is None:
+            gem_regions = [thing["region"] for thing in world_map.things if GEM_NAMES.intersection(thing["names"])]
+        self._gem_at = np.zeros(n, dtype=bool)
+        for region in gem_regions:
+            self._gem_at[world_map.index[region]] = True
+        # the listed and gem cost models, shared with the map rather than copied
+        costs = [np.frombuffer(world_map.cost_matrix(have_gem), dtype=np.intc).reshape(n, n) for have_gem in [False, True]]
+        # neighbours of each region padded to the largest degree; padding can never be afforded
+        degree = max([len(portals) for portals in world_map.region_portals] + [1])
+        self._neighbours = np.zeros((n, degree), dtype=np.intp)
+        self._step_costs = np.full((2, n, degree), np.iinfo(np.int64).max, dtype=np.int64)
+        self._padding = np.ones((n, degree), dtype=bool)
+        for i, portals in enumerate(world_map.region_portals):
+            for k, portal_index in enumerate(portals):
+                a, b = world_map.portal_a[portal_index], world_map.portal_b[portal_index]
+                j = b if a == i else a
+                self._neighbours[i, k] = j
+                self._padding[i, k] = False
+                for have_gem in [0, 1]:
+                    self._step_costs[have_gem, i, k] = costs[have_gem][i, j]
+
+    @staticmethod
+    def _choose(allowed, rng):
+        # the index of a uniformly random True in each row (every row has one)
+        counts = allowed.sum(axis=1)
+        picks = (rng.random(len(counts)) * counts).astype(np.int64)
+        return (allowed.cumsum(axis=1) > picks[:, None]).argmax(axis=1)
+
+    def walk(self, n_walkers, start, coins, max_steps=100, policy="random", rng=None):
+        """ WalkStats for n_walkers walks starting from region start with coins each """
+        if policy not in self.POLICIES:
+            raise ValueError("unknown policy %s (expected one of %s)" % (policy, ", ".join(self.POLICIES)))
+        rng = rng if rng is not None else np.random.default_rng()
+        n = self.map.n
+        start = self.map.index[start]
+        position = np.full(n_walkers, start, dtype=np.intp)
+        purse = np.full(n_walkers, coins, dtype=np.int64)
+        have_gem = np.full(n_walkers, self._gem_at[start])
+        steps = np.zeros(n_walkers, dtype=np.int64)
+        first_step = np.full((n_walkers, n), -1, dtype=np.int32)
+        first_step[:, start] = 0
+        arrival_coins = np.zeros((n_walkers, n), dtype=np.int64)
+        arrival_coins[:, start] = coins
+        stranded = np.zeros(n_walkers, dtype=bool)
+        walking = np.arange(n_walkers)
+        for step in range(1, max_steps + 1):
+            if not len(walking):
+                break
+            here = position[walking]
+            step_costs = self._step_costs[have_gem[walking].astype(np.intp), here]
+            affordable = step_costs <= purse[walking, None]
+            can_move = affordable.any(axis=1)
+            stranded[walking[~can_move]] = True
+            walking, here, step_costs, affordable = (walking[can_move], here[can_move],
+                                                     step_costs[can_move], affordable[can_move])
+            if not len(walking):
+                break
+            destinations = self._neighbours[here]
+            if policy == "cheapest":
+                cheapest = np.where(affordable, step_costs, np.iinfo(np.int64).max).min(axis=1)
+                allowed = affordable & (step_costs == cheapest[:, None])
+            elif policy == "unvisited":
+                allowed = affordable & (first_step[walking[:, None], destinations] < 0)
+                allowed[~allowed.any(axis=1)] = affordable[~allowed.any(axis=1)]
+            else:
+                allowed = affordable
+            choice = self._choose(allowed, rng)
+            rows = np.arange(len(walking))
+            destination = destinations[rows, choice]
+            position[walking] = destination
+            purse[walking] -= step_costs[rows, choice]
+            have_gem[walking] |= self._gem_at[destination]
+            steps[walking] = step
+            arrived = first_step[walking, destination] < 0
+            first_step[walking[arrived], destination[arrived]] = step
+            arrival_coins[walking[arrived], destination[arrived]] = purse[walking[arrived]]
+        stats = WalkStats(n)
+        reached = first_step >= 0
+        stats.walkers = n_walkers
+        stats.reached = reached.sum(axis=0)
+        stats.steps_to_reach = np.where(reached, first_step, 0).sum(axis=0, dtype=np.int64)
+        stats.coins_on_arrival = arrival_coins.sum(axis=0)
+        stats.coins_left = int(purse.sum())
+        stats.steps = int(steps.sum())
+        stats.stranded = int(stranded.sum())
+        stats.with_gem = int(have_gem.sum())
+        return stats
+
+# each worker process keeps its own copy of the simulator, sent once by the pool initializer
+_worker_simulator = None
+_worker_options = None
+
+def _init_worker(simulator, options):
+    global _worker_simulator, _worker_options
+    _worker_simulator = simulator
+    _worker_options = options
+
+def _walk_chunk(job):
+    n_walkers, seed = job
+    return _worker_simulator.walk(n_walkers, rng=np.random.default_rng(seed), **_worker_options)
+
+def simulate(simulator, n_walkers, start="A", coins=15, max_steps=100, policy="random",
+             processes=None, chunk_size=65536, seed=None):
+    """ WalkStats over n_walkers walks, stepped chunk_size walkers at a time
+
+    Each chunk gets its own seed spawned from seed, so results are the
+    same whether or not the chunks are sharded across processes. """
+    sizes = [min(chunk_size, n_walkers - i) for i in range(0, n_walkers, chunk_size)]
+    jobs = list(zip(sizes, np.random.SeedSequence(seed).spawn(len(sizes))))
+    options = {"start": start, "coins": coins, "max_steps": max_steps, "policy": policy}
+    stats = WalkStats(simulator.map.n)
+    if not processes:
+        _init_worker(simulator, options)
+        for job in jobs:
+            stats += _walk_chunk(job)
+        return stats
+    with multiprocessing.Pool(processes, _init_worker, (simulator, options)) as pool:
+        for chunk_stats in pool.imap_unordered(_walk_chunk, jobs):
+            stats += chunk_stats
+    return stats
+
+def report(record, world_map):
+    lines = ["%s walks: %.2f coins left, %.1f steps on average; %.1f%% stranded, %.1f%% found a gem" % (
+        record["walkers"], record["mean_coins_left"], record["mean_steps"],
+        100 * record["stranded"], 100 * record["with_gem"])]
+    lines.append("%-6s %-32s %9s %12s %14s" % ("region", "name", "reached", "mean steps", "coins on entry"))
+    for i, region_id in enumerate(world_map.ids):
+        region = record["regions"][region_id]
+        if region["reach_probability"]:
+            lines.append("%-6s %-32s %8.2f%% %12.2f %14.2f" % (
+                region_id, world_map.names[i][:32], 100 * region["reach_probability"],
+                region["mean_steps_to_reach"], region["mean_coins_on_arrival"]))
+        else:
+            lines.append("%-6s %-32s %8.2f%% %12s %14s" % (region_id, world_map.names[i][:32], 0, "-", "-"))
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate many walks over the portal graph to balance costs and coins")
+    parser.add_argument("--walkers", type=int, default=1000000)
+    parser.add_argument("--from", dest="start", default="A", help="starting region (default: A)")
+    parser.add_argument("--coins", type=int, default=15, help="starting coins (default: 15)")
+    parser.add_argument("--max-steps", type=int, default=100, help="longest walk (default: 100)")
+    parser.add_argument("--policy", choices=Simulator.POLICIES, default="random")
+    parser.add_argument("--gem", action="append", default=None,
+                        help="region holding a gem to pick up (repeatable; default: gems placed on the map)")
+    parser.add_argument("--map", default="world.json", help="map file (default: world.json)")
+    parser.add_argument("--processes", type=int, default=None, help="shard walkers across this many processes")
+    parser.add_argument("--chunk-size", type=int, default=65536, help="walkers stepped together (default: 65536)")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", default=None, help="also write the statistics to this JSON file")
+    args = parser.parse_args()
+
+    world_map = WorldMap.load(args.map)
+    gem_regions = [region.upper() for region in args.gem] if args.gem else None
+    simulator = Simulator(world_map, gem_regions)
+    start_time = time.perf_counter()
+    stats = simulate(simulator, args.walkers, args.start.upper(), args.coins, args.max_steps, args.policy,
+                     args.processes, args.chunk_size, args.seed)
+    elapsed = time.perf_counter() - start_time
+    record = stats.record(world_map)
+    print(report(record, world_map))
+    print("%.2fs, %.0f walks/sec, %.0f steps/sec" % (elapsed, stats.walkers / elapsed, stats.steps / elapsed))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(record, f, indent=1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+import argparse
+import heapq
+import json
+import multiprocessing
+import time
+from itertools import count
+
+from zodiacquest import World, You, NullSink, GEM_NAMES, GO_CMD, TAKE_CMD, LEAVE_CMD
+
+def thing_key(thing):
+    # things with the same names, strings and moveability are interchangeable
+    return (tuple(thing.names), tuple(thing.strings), thing.moveable)
+
+def inventory_key(inventory):
+    return tuple(sorted(thing_key(thing) for thing in inventory.things))
+
+class Problem:
+    """ the game reduced to plain tuples, so states hash canonically and pickle cheaply
+
+    A state is (region index, coins, things you carry, things in each
+    region), with each collection of things as a sorted tuple of
+    thing keys. Moves mirror You.go/take/leave. Commands and
+    collections of things are shared between the states using them,
+    so a state costs little more than its own tuple. """
+
+    def __init__(self, world, you, goal_region=None, goal_things=()):
+        regions = list(world.regions)
+        self._region_ids = [region.id for region in regions]
+        self._go_commands = ["%s%s" % (GO_CMD, region_id) for region_id in self._region_ids]
+        self._shared = dict()
+        index = {region.id: i for i, region in enumerate(regions)}
+        self._neighbours = []
+        for region in regions:
+            self._neighbours.append([(index[portal.destination(region).id], portal.listed_cost, portal.cost_with_gem(True))
+                                     for portal in region.portals])
+        self.start = self.state_of(you)
+        self._goal_region = None if goal_region is None else index[world.regions[goal_region].id]
+        self._goal_things = tuple(name.upper() for name in goal_things)
+        # cheapest cost to the goal if you had a gem all the way: never an overestimate
+        if self._goal_region is None:
+            self._lower_bounds = [0] * len(regions)
+        else:
+            goal_id = self._region_ids[self._goal_region]
+            self._lower_bounds = []
+            for region in regions:
+                route = world.route(region.id, goal_id, have_gem=True)
+                self._lower_bounds.append(route[1] if route else None)
+
+    def state_of(self, you):
+        """ the state of the game you are in """
+        return (self._region_ids.index(you.region.id), you.coins, inventory_key(you.inventory),
+                tuple(inventory_key(you.inventory_of(region)) for region in you.region.world.regions))
+
+    def __getstate__(self):
+        # worker processes build their own shared values
+        state = dict(self.__dict__)
+        state["_shared"] = dict()
+        return state
+
+    def _share(self, value):
+        return self._shared.setdefault(value, value)
+
+    @staticmethod
+    def _have_gem_p(things):
+        for names, strings, moveable in things:
+            if GEM_NAMES.intersection(names) or GEM_NAMES.intersection(strings):
+                return True
+        return False
+
+    @staticmethod
+    def _single(things, name):
+        # You.take/leave only succeed when exactly one thing answers to the name
+        matches = [i for i, (names, strings, moveable) in enumerate(things) if name in names]
+        return matches[0] if len(matches) == 1 else None
+
+    @classmethod
+    def _unique_name(cls, things, thing):
+        """ (name, index) for the first of thing's names that picks it out of things alone, or None
+
+        Any such name makes the same move, so one is enough. """
+        for name in thing[0]:
+            i = cls._single(things, name)
+            if i is not None:
+                return name, i
+        return None
+
+    def successors(self, state):
+        """ (command, coins spent, next state) for every legal move """
+        region, coins, carried, placed = state
+        here = placed[region]
+        have_gem = self._have_gem_p(carried) or self._have_gem_p(here)
+        for destination, listed_cost, gem_cost in self._neighbours[region]:
+            cost = gem_cost if have_gem else listed_cost
+            if cost <= coins:
+                yield (self._go_commands[destination], cost, (destination, coins - cost, carried, placed))
+        for thing in set(carried):
+            # a thing without a name (or only names it shares) can't be named in a command
+            unique = self._unique_name(carried, thing) if thing[2] else None
+            if unique is not None:
+                name, i = unique
+                left = self._share(placed[:region] + (self._share(tuple(sorted(here + (thing,)))),) + placed[region + 1:])
+                yield (self._share(LEAVE_CMD + name), 0,
+                       (region, coins, self._share(carried[:i] + carried[i + 1:]), left))
+        for thing in set(here):
+            unique = self._unique_name(here, thing) if thing[2] else None
+            if unique is not None:
+                name, i = unique
+                taken = self._share(placed[:region] + (self._share(here[:i] + here[i + 1:]),) + placed[region + 1:])
+                yield (self._share(TAKE_CMD + name), 0,
+                       (region, coins, self._share(tuple(sorted(carried + (thing,)))), taken))
+
+    def goal_p(self, state):
+        region, coins, carried, placed = state
+        if self._goal_region is not None and region != self._goal_region:
+            return False
+        carried_names = set()
+        for names, strings, moveable in carried:
+            carried_names.update(names)
+        return all(name in carried_names for name in self._goal_things)
+
+    def heuristic(self, state):
+        """ lower bound on the coins still to spend, or None if the goal is out of reach """
+        return self._lower_bounds[state[0]]
+
+class Solution:
+    def __init__(self, algorithm, script, cost, nodes, seconds):
+        self.algorithm = algorithm
+        self.script = script
+        self.cost = cost
+        self.nodes = nodes
+        self.seconds = seconds
+
+    @property
+    def found_p(self):
+        return self.script is not None
+
+    @property
+    def nodes_per_sec(self):
+        return self.nodes / self.seconds if self.seconds > 0 else float("inf")
+
+    def __str__(self):
+        if self.found_p:
+            outcome = "%s commands costing %s coins: %s" % (len(self.script), self.cost, ", ".join(self.script))
+        else:
+            outcome = "no solution"
+        return "%s: %s (%s nodes in %.3fs, %.0f nodes/sec)" % (
+            self.algorithm, outcome, self.nodes, self.seconds, self.nodes_per_sec)
+
+def replay(world, problem, snapshot, solution):
+    """ check solution by carrying out its script in a new game from snapshot, all in one apply_many """
+    you = You.restore(world, snapshot, events=NullSink())
+    results = you.apply_many(solution.script, stop_on_error=True)
+    if not all(results):
+        return "replay: %s failed (command %s)" % (solution.script[len(results) - 1], len(results))
+    spent = snapshot["coins"] - you.coins
+    if not problem.goal_p(problem.state_of(you)):
+        return "replay: the script does not reach the goal"
+    if spent != solution.cost:
+        return "replay: reaches the goal, but costs %s coins, not %s" % (spent, solution.cost)
+    return "replay: reaches the goal for %s coins" % spent
+
+# worker processes keep their own copy of the problem, sent once by the pool initializer
+_worker_problem = None
+
+def _init_worker(problem):
+    global _worker_problem
+    _worker_problem = problem
+
+def _expand_chunk(states):
+    return [list(_worker_problem.successors(state)) for state in states]
+
+def _chunks(items, n):
+    size = max(1, (len(items) + n - 1) // n)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+class Solver:
+    """ search the game state space for a command script reaching a goal
+
+    bfs finds the fewest commands; astar and idastar find the fewest
+    coins spent, using cheapest-route costs as the heuristic. bfs and
+    astar can expand their frontier across a multiprocessing pool. """
+
+    ALGORITHMS = ["bfs", "astar", "idastar"]
+
+    def __init__(self, problem, processes=None, chunk_size=256):
+        self._problem = problem
+        self._processes = processes
+        self._chunk_size = chunk_size
+        self._pool = None
+
+    def solve(self, algorithm="astar"):
+        if algorithm not in self.ALGORITHMS:
+            raise ValueError("unknown algorithm %s (expected one of %s)" % (algorithm, ", ".join(self.ALGORITHMS)))
+        start_time = time.perf_counter()
+        if self._processes and algorithm != "idastar":
+            self._pool = multiprocessing.Pool(self._processes, _init_worker, (self._problem,))
+        try:
+            script, cost, nodes = getattr(self, "_" + algorithm)()
+        finally:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool = None
+        return Solution(algorithm, script, cost, nodes, time.perf_counter() - start_time)
+
+    def _expand(self, states):
+        if self._pool is None or len(states) < self._chunk_size:
+            return [list(self._problem.successors(state)) for state in states]
+        expansions = []
+        for chunk_expansions in self._pool.map(_expand_chunk, _chunks(states, self._processes * 4)):
+            expansions.extend(chunk_expansions)
+        return expansions
+
+    @staticmethod
+    def _script(parents, state):
+        script = []
+        while parents[state] is not None:
+            state, cmd = parents[state]
+            script.append(cmd)
+        script.reverse()
+        return script
+
+    def _bfs(self):
+        problem = self._problem
+        start = problem.start
+        parents = {start: None}
+        frontier = [start]
+        nodes = 0
+        while frontier:
+            for state in frontier:
+                if problem.goal_p(state):
+                    return self._script(parents, state), start[1] - state[1], nodes
+            nodes += len(frontier)
+            next_frontier = []
+            for state, successors in zip(frontier, self._expand(frontier)):
+                for cmd, cost, next_state in successors:
+                    if next_state not in parents:
+                        parents[next_state] = (state, cmd)
+                        next_frontier.append(next_state)
+            frontier = next_frontier
+        return None, None, nodes
+
+    def _astar(self):
+        problem = self._problem
+        start = problem.start
+        if problem.heuristic(start) is None:
+            return None, None, 0
+        tiebreak = count()
+        parents = {start: None}
+        best = {start: (0, 0)}
+        open_heap = [(problem.heuristic(start), 0, next(tiebreak), 0, start)]
+        nodes = 0
+        batch_size = self._chunk_size if self._pool is not None else 1
+        while open_heap:
+            batch = []
+            while open_heap and len(batch) < batch_size:
+                f, steps, _, g, state = heapq.heappop(open_heap)
+                if best[state] < (g, steps):
+                    # stale entry, state since reached more cheaply
+                    continue
+                if problem.goal_p(state):
+                    if not batch:
+                        return self._script(parents, state), g, nodes
+                    # only optimal once nothing cheaper is left to expand
+                    heapq.heappush(open_heap, (f, steps, next(tiebreak), g, state))
+                    break
+                batch.append((g, steps, state))
+            nodes += len(batch)
+            for (g, steps, state), successors in zip(batch, self._expand([state for g, steps, state in batch])):
+                for cmd, cost, next_state in successors:
+                    h = problem.heuristic(next_state)
+                    if h is None:
+                        continue
+                    next_best = (g + cost, steps + 1)
+                    if next_state in best and best[next_state] <= next_best:
+                        continue
+                    best[next_state] = next_best
+                    parents[next_state] = (state, cmd)
+                    heapq.heappush(open_heap, (g + cost + h, steps + 1, next(tiebreak), g + cost, next_state))
+        return None, None, nodes
+
+    def _idastar(self):
+        problem = self._problem
+        start = problem.start
+        bound = problem.heuristic(start)
+        if bound is None:
+            return None, None, 0
+        nodes = 0
+        while True:
+            # transposition table for this iteration: cheapest (coins, steps) seen per state
+            seen = {start: (0, 0)}
+            path = []
+            next_bound = None
+            stack = [(start, 0, iter(problem.successors(start)))]
+            nodes += 1
+            if problem.goal_p(start):
+                return [], 0, nodes
+            while stack:
+                state, g, successors = stack[-1]
+                for cmd, cost, next_state in successors:
+                    h = problem.heuristic(next_state)
+                    if h is None:
+                        continue
+                    f = g + cost + h
+                    if f > bound:
+                        next_bound = f if next_bound is None else min(next_bound, f)
+                        continue
+                    reached = (g + cost, len(path) + 1)
+                    if next_state in seen and seen[next_state] <= reached:
+                        continue
+                    seen[next_state] = reached
+                    path.append(cmd)
+                    nodes += 1
+                    if problem.goal_p(next_state):
+                        return list(path), g + cost, nodes
+                    stack.append((next_state, g + cost, iter(problem.successors(next_state))))
+                    break
+                else:
+                    stack.pop()
+                    if path:
+                        path.pop()
+            if next_bound is None:
+                return None, None, nodes
+            bound = next_bound
+
+def main():
+    parser = argparse.ArgumentParser(description="Search for a command script that reaches a goal")
+    parser.add_argument("--from", dest="from_region", default="A", help="starting region (default: A)")
+    parser.add_argument("--to", dest="to_region", help="region to finish in")
+    parser.add_argument("--carry", action="append", default=[], help="name of a thing to be carrying at the end")
+    parser.add_argument("--coins", type=int, default=15)
+    parser.add_argument("--algorithm", choices=Solver.ALGORITHMS + ["all"], default="astar")
+    parser.add_argument("--snapshot", default=None, help="search from this saved game (JSON) instead of --from/--coins")
+    parser.add_argument("--processes", type=int, default=None, help="expand the frontier across this many processes")
+    parser.add_argument("--replay", action="store_true", help="check each solution by replaying it in the game")
+    args = parser.parse_args()
+
+    world = World()
+    if args.snapshot:
+        with open(args.snapshot, 'r') as f:
+            you = You.restore(world, json.load(f))
+    else:
+        you = You(world.regions[args.from_region.upper()], coins=args.coins)
+    problem = Problem(world, you, goal_region=args.to_region and args.to_region.upper(), goal_things=args.carry)
+    solver = Solver(problem, processes=args.processes)
+    algorithms = Solver.ALGORITHMS if args.algorithm == "all" else [args.algorithm]
+    snapshot = you.snapshot()
+    for algorithm in algorithms:
+        solution = solver.solve(algorithm)
+        print(solution)
+        if args.replay and solution.found_p:
+            print(replay(world, problem, snapshot, solution))
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,16 @@
 #!/usr/bin/env python3
-from collections.abc import Mapping
+import hashlib
+import json
+import mmap
+import os
+import pickle
+import struct
+import sys
+import threading
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import Mapping, Set
 from itertools import chain
 
 ZODIACS = ["ARIES", "TAURUS", "GEMINI", 
@@ -17,16 +28,159 @@ GEMS = ["GEM",
         "JASPER", "ONYX",
         "JADE"]
 
+GEM_NAMES = frozenset(GEMS)
+ZODIAC_NAMES = frozenset(ZODIACS)
+
 # Command prefixes
 GO_CMD="G"
 LEAVE_CMD="L "
 TAKE_CMD="T "
 QUIT_CMD="Q"
+UNDO_CMD="U"
+REDO_CMD="R"
+
+# Commands compiled to (opcode, argument) tuples; see compile_command
+OP_GO, OP_TAKE, OP_LEAVE, OP_UNDO, OP_REDO, OP_QUIT = range(6)
+
+# Precompiled caches (word store and derived indexes) live here, next to the dictionary
+CACHE_DIR=".zodiacquest_cache"
+
+# What the game has to tell you, by event kind: a format string or function of the event's values.
+# Events with no message are shown only to structured sinks.
+EVENT_MESSAGES = {
+    "moved": None,
+    "took": None,
+    "left": None,
+    "transformed": None,
+    "cannot_afford": "Sorry, you cannot afford to go to %(region)s",
+    "no_portal": "ERROR: you cannot get to %(region)s from here",
+    "could_not_go": "ERROR: could not go to %(region)s",
+    "not_moveable": "Sorry, %(thing)s is not moveable",
+    "ambiguous_take": "ERROR: attempted to take more than one thing: %(name)s",
+    "no_thing_to_take": "ERROR: no thing to take: %(name)s",
+    "could_not_take": "ERROR: could not take %(name)s",
+    "ambiguous_leave": "ERROR: attempted to leave more than one thing: %(name)s",
+    "no_thing_to_leave": "ERROR: no thing to leave: %(name)s",
+    "could_not_leave": "ERROR: could not leave %(name)s",
+    "no_magician": "ERROR: there is no %(name)s here to do magic",
+    "nothing_to_transform": "ERROR: there is no %(name)s here to transform",
+    "not_a_thing": "Sorry, %(name)s is not a Thing",
+    "not_transformable": "Sorry, %(name)s cannot become %(to_name)s by changing or adding a single sound at the front",
+    "nothing_to_undo": "ERROR: nothing to undo",
+    "nothing_to_redo": "ERROR: nothing to redo",
+    "parse_error": "ERROR: did not understand command %(cmd)s",
+    "did_you_mean": lambda values: "Did you mean %s?" % " or ".join(values["names"]),
+    "quit": lambda values: "\n".join(values["history"]),
+}
+
+class Event:
+    """ something that happened in the game, kept as values until a sink wants it as text or JSON """
+
+    __slots__ = ("kind", "values")
+
+    def __init__(self, kind, **values):
+        self.kind = kind
+        self.values = values
+
+    @property
+    def message(self):
+        """ the text the terminal game shows for this event (None if it shows nothing) """
+        template = EVENT_MESSAGES[self.kind]
+        if template is None:
+            return None
+        if callable(template):
+            return template(self.values)
+        return template % self.values
+
+    @property
+    def record(self):
+        """ JSON-ready {"event": kind, ...values}, with game objects as their ids or names """
+        record = {"event": self.kind}
+        for key, value in self.values.items():
+            if isinstance(value, Region):
+                value = value.id
+            elif isinstance(value, Thing):
+                value = value.names[0] if value.names else None
+            record[key] = value
+        return record
+
+def render_text(events):
+    """ the messages of events as the terminal game shows them, one per line """
+    return "".join("%s\n" % message for message in (event.message for event in events) if message is not None)
+
+class NullSink:
+    """ drops every event, for headless runs (e.g. solvers) that only care about the state """
+
+    def emit(self, event):
+        pass
+
+    def flush(self):
+        pass
+
+class EventLog:
+    """ keeps events until they are popped """
+
+    def __init__(self):
+        self.events = []
+
+    def emit(self, event):
+        self.events.append(event)
+
+    def pop(self):
+        events = self.events
+        self.events = []
+        return events
+
+    def flush(self):
+        pass
+
+class TextSink(EventLog):
+    """ renders events as the terminal game's messages, buffered until flushed (or popped as text)
+
+    stream defaults to whatever sys.stdout is at the time of writing.
+    Unbuffered, each message is written as soon as it is emitted. """
+
+    def __init__(self, stream=None, buffered=True):
+        super().__init__()
+        self._stream = stream
+        self._buffered = buffered
+
+    def emit(self, event):
+        self.events.append(event)
+        if not self._buffered:
+            self.flush()
+
+    def pop_text(self):
+        """ the messages of the events so far, one per line, forgetting the events """
+        return render_text(self.pop())
+
+    def flush(self):
+        text = self.pop_text()
+        if text:
+            (self._stream or sys.stdout).write(text)
+
+class JsonLinesSink:
+    """ writes each event as a line of JSON, with tags (e.g. the session) added to every record """
+
+    def __init__(self, stream, **tags):
+        self._stream = stream
+        self._tags = tags
+
+    def emit(self, event):
+        record = dict(self._tags)
+        record.update(event.record)
+        self._stream.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def flush(self):
+        self._stream.flush()
 
 class Thing:
+    # slotted, with interned names, as there can be very many things across sessions
+    __slots__ = ("_names", "_strings", "_moveable")
+
     def __init__(self, names=[], strings=[], moveable=True):
-        self._names = list(names)
-        self._strings = list(strings)
+        self._names = tuple(sys.intern(name) for name in names)
+        self._strings = tuple(sys.intern(string) for string in strings)
         self._moveable = moveable
 
     @property
@@ -41,76 +195,157 @@ class Thing:
     def strings(self):
         return self._strings
 
+    @property
+    def record(self):
+        """ JSON-ready [type, names, strings, moveable, extra], enough to recreate the thing
+
+        extra holds what a subclass keeps besides (e.g. a Paper's sheets). """
+        return [type(self).__name__, list(self._names), list(self._strings), self._moveable, self._extra_record()]
+
+    def _extra_record(self):
+        return {}
+
+    def _restore_extra(self, extra):
+        pass
+
+    @staticmethod
+    def from_record(record):
+        type_name, names, strings, moveable = record[:4]
+        if type_name not in THING_TYPES:
+            raise ValueError("can't restore a thing of type %s" % type_name)
+        cls = THING_TYPES[type_name]
+        thing = cls.__new__(cls)
+        Thing.__init__(thing, names, strings, moveable)
+        thing._restore_extra(record[4] if len(record) > 4 else {})
+        return thing
+
 class Wand(Thing):
+    __slots__ = ("_magic",)
+
     def __init__(self, names, magic):
         super().__init__(names)
         self._magic = magic
 
+    def _extra_record(self):
+        # magic is kept by name, so it has to be one of World's
+        name = getattr(self._magic, "__name__", None)
+        if name is None or getattr(World, name, None) is not self._magic:
+            raise ValueError("can't record the magic of wand %s" % "/".join(self._names))
+        return {"magic": name}
+
+    def _restore_extra(self, extra):
+        if not hasattr(World, extra.get("magic", "")):
+            raise ValueError("can't restore the magic of wand %s" % "/".join(self._names))
+        self._magic = getattr(World, extra["magic"])
+
 class Paper(Thing):
+    __slots__ = ("_sheets", "_color", "_runes")
+
     def __init__(self, names, sheets=1, color="", runes="", strings=""):
-        super().__init__(names)
+        super().__init__(names, strings)
         self._sheets = sheets
         self._color = color
         self._runes = runes
-        self._strings = strings
+
+    def _extra_record(self):
+        return {"sheets": self._sheets, "color": self._color, "runes": self._runes}
+
+    def _restore_extra(self, extra):
+        self._sheets = extra.get("sheets", 1)
+        self._color = extra.get("color", "")
+        self._runes = extra.get("runes", "")
 
 class Inventory:
+    """ things in one place, indexed incrementally by add/remove
+
+    Things are kept in insertion-ordered dicts (used as ordered sets) so
+    removal is O(1), and the counts of names/strings and of gem and
+    zodiac names are kept up to date so the category checks are O(1). """
+
+    __slots__ = ("_thing_lookup", "_names_to_things", "_name_counts", "_gem_count", "_zodiac_count", "_version")
+
     def __init__(self):
-        self._things = []
+        self._thing_lookup = dict()
         self._names_to_things = dict()
-        self._strings_to_things = dict()
+        self._name_counts = dict()
+        self._gem_count = 0
+        self._zodiac_count = 0
+        self._version = 0
+
+    def _count(self, name, delta):
+        count = self._name_counts.get(name, 0) + delta
+        if count:
+            self._name_counts[name] = count
+        else:
+            del self._name_counts[name]
+        if name in GEM_NAMES:
+            self._gem_count += delta
+        if name in ZODIAC_NAMES:
+            self._zodiac_count += delta
 
     def add(self, thing):
-        self._things.append(thing)
+        self._version += 1
+        self._thing_lookup[thing] = None
         for name in thing.names:
-            if name in self._names_to_things:
-                self._names_to_things[name].append(thing)
-            else:
-                self._names_to_things[name] = [thing]
-        for name in thing.strings:
-            if name in self._strings_to_things:
-                self._strings_to_things[name].append(thing)
-            else:
-                self._strings_to_things[name] = [thing]
+            self._names_to_things.setdefault(name, dict())[thing] = None
+            self._count(name, 1)
+        for string in thing.strings:
+            self._count(string, 1)
 
     def get(self, name):
         if name in self._names_to_things:
-            return self._names_to_things[name]
+            return list(self._names_to_things[name])
         else:
             return None
     
     def remove(self, thing):
         if thing.moveable:
+            if thing not in self._thing_lookup:
+                raise Exception("ERROR: could not remove thing %s from inventory" % thing)
             for name in thing.names:
                 if name in self._names_to_things:
-                    self._names_to_things[name] = [t for t in self._names_to_things[name] if t != thing]
+                    things = self._names_to_things[name]
+                    things.pop(thing, None)
+                    if not things:
+                        del self._names_to_things[name]
+                    self._count(name, -1)
                 else:
-                    raise Exception("ERROR: expected name %s in names_to_things")
+                    raise Exception("ERROR: expected name %s in names_to_things" % name)
             for string in thing.strings:
-                if string in self._strings_to_things:
-                    self._strings_to_things[string] = [s for s in self._strings_to_things[string] if s != thing]
+                if string in self._name_counts:
+                    self._count(string, -1)
                 else:
-                    raise Exception("ERROR: expected string %s in strings_to_things")
-            try:
-                self._things.remove(thing)
-                return thing
-            except Exception as e:
-                raise Exception("ERROR: could not remove thing %s from inventory" % thing)
+                    raise Exception("ERROR: expected string %s in name_counts" % string)
+            del self._thing_lookup[thing]
+            self._version += 1
+            return thing
         else:
-            print("Sorry, %s is not moveable" % (thing))
+            # not moveable: callers tell you so
             return False
 
     @property
     def things(self):
-        return self._things
+        return list(self._thing_lookup)
+
+    def copy(self):
+        """ a new inventory holding the same things """
+        inventory = Inventory()
+        for thing in self._thing_lookup:
+            inventory.add(thing)
+        return inventory
+
+    @property
+    def version(self):
+        """ changes whenever a thing is added or removed """
+        return self._version
 
     @property
     def thing_names(self):
-        return list(chain.from_iterable([thing.names for thing in self._things]))
+        return list(chain.from_iterable([thing.names for thing in self._thing_lookup]))
     
     @property
     def string_names(self):
-        return list(chain.from_iterable([thing.strings for thing in self._things]))
+        return list(chain.from_iterable([thing.strings for thing in self._thing_lookup]))
 
     @property
     def all_names(self):
@@ -118,27 +353,39 @@ class Inventory:
 
     @property
     def empty_p(self):
-        return (len(self.all_names) == 0)
+        return (len(self._name_counts) == 0)
 
     @property
     def have_gem_p(self):
-        all_names = self.all_names
-        for gem in GEMS:
-            if gem in all_names:
-                return True
-        return False
+        return self._gem_count > 0
 
     @property
     def have_zodiac_p(self):
-        all_names = self.all_names
-        for zodiac in ZODIACS:
-            if zodiac in all_names:
-                return True
-        return False
+        return self._zodiac_count > 0
+
+    def have_name_p(self, name):
+        """ does any thing here have name as one of its names or strings? """
+        return name in self._name_counts
 
     def have_thing_p(self, thing):
         return thing in self._thing_lookup
 
+    def near(self, name, max_distance=2):
+        """ (distance, name) for each name of a thing here within max_distance edits of name, nearest first """
+        return sorted((distance, thing_name) for distance, thing_name in
+                      ((edit_distance(name, thing_name), thing_name) for thing_name in self._names_to_things)
+                      if distance <= max_distance)
+
+    def hidden_names(self, scanner=None):
+        """ {name or string: zodiac and gem names hidden in it} for everything here hiding any """
+        scanner = scanner or HIDDEN_NAMES
+        hidden = dict()
+        for name in self._name_counts:
+            names = scanner.names_in(name)
+            if names:
+                hidden[name] = names
+        return hidden
+
     def __str__(self):
         if self.empty_p:
             return "no things or strings"
@@ -146,20 +393,33 @@ class Inventory:
             return "\n".join(self.all_names)
 
 class Region:
-    def __init__(self, world, name, id, monument=None, **kwargs):
+    """ a region of the map: a view onto its entry in the world's compiled WorldMap,
+    plus what can change during a game (its monument and inventory) """
+
+    __slots__ = ("_world", "_index", "portals", "monument", "inventory")
+
+    def __init__(self, world, index, **kwargs):
         self._world = world
-        self._name = name
-        self.id = id
+        self._index = index
         self.portals = RegionPortals(self)
-        self.monument = monument
+        self.monument = world.map.monuments[index]
         self.inventory = Inventory(**kwargs)
 
-    def add_portal(self, portal):
-        self.portals.add_portal(portal, portal.destination(self))
+    @property
+    def world(self):
+        return self._world
+
+    @property
+    def index(self):
+        return self._index
+
+    @property
+    def id(self):
+        return self._world.map.ids[self._index]
 
     @property
     def name(self):
-        return self._name
+        return self._world.map.names[self._index]
 
     @property
     def name_and_id(self):
@@ -168,35 +428,55 @@ class Region:
     def __str__(self):
         return "%s (%s)" % (self.name, self.id)
 
+def portal_cost(listed_cost, have_gem):
+    # with a gem, any 3-coin portal costs only 1
+    if listed_cost == 3:
+        if have_gem:
+            return 1
+    return listed_cost
+
 class Portal:
-    def __init__(self, region_a, region_b, cost):
-        self._region_a = region_a
-        self._region_b = region_b
-        self._cost = cost
-        self._region_a.add_portal(self)
-        self._region_b.add_portal(self)
+    """ a portal between two regions: a view onto its entry in the world's compiled WorldMap """
+
+    __slots__ = ("_world", "_index")
+
+    def __init__(self, world, index):
+        self._world = world
+        self._index = index
 
     def __str__(self):
-        return "Portal between %s and %s costing %s" % (str(self._region_a), str(self._region_b), self._cost)
+        region_a, region_b = self.regions
+        return "Portal between %s and %s costing %s" % (str(region_a), str(region_b), self.listed_cost)
+
+    @property
+    def index(self):
+        return self._index
 
     @property
     def listed_cost(self):
-        return self._cost
+        return self._world.map.portal_costs[self._index]
+
+    @property
+    def regions(self):
+        world_map = self._world.map
+        return [self._world.regions.at(world_map.portal_a[self._index]),
+                self._world.regions.at(world_map.portal_b[self._index])]
 
     def cost(self, you):
         # cost for you (possibly depending on whether or not you have a gem)
-        if self.listed_cost == 3:
-            if you.have_gem_p:
-                return 1
-        return self.listed_cost
+        return self.cost_with_gem(you.have_gem_p)
+
+    def cost_with_gem(self, have_gem):
+        return portal_cost(self.listed_cost, have_gem)
 
     def destination(self, region):
-        if region.id == self._region_a.id:
-            return self._region_b
-        elif region.id == self._region_b.id:
-            return self._region_a
+        world_map = self._world.map
+        if region.index == world_map.portal_a[self._index]:
+            return self._world.regions.at(world_map.portal_b[self._index])
+        elif region.index == world_map.portal_b[self._index]:
+            return self._world.regions.at(world_map.portal_a[self._index])
         else:
-            print("ERROR: Portal destination requested for region %s not connected to portal: %s" % (region, self))
+            raise ValueError("Portal destination requested for region %s not connected to portal: %s" % (region, self))
 
     def transit(self, you):
         # move you to destination if you can afford it
@@ -205,8 +485,9 @@ class Portal:
             you.coins -= self.cost(you)
             you.region = destination
         else:
-            print("Sorry, you cannot afford to go to %s" % destination)
+            you.events.emit(Event("cannot_afford", region=destination))
             return False
+        you.events.emit(Event("moved", region=destination, coins=you.coins))
         return True
 
 class Portals(Mapping):
@@ -227,30 +508,34 @@ class Portals(Mapping):
         return len(self._portals)
 
 class RegionPortals(Mapping):
+    """ portals out of a region, looked up by destination name or id through the compiled map """
+
+    __slots__ = ("_from_region",)
+
     def __init__(self, from_region):
         self._from_region = from_region
-        self._portals = []
-        self._destination_region_lookup = dict()
-
-    def add_portal(self, portal, destination_region):
-        self._portals.append(portal)
-        for region_name in destination_region.name_and_id:
-            self._destination_region_lookup[region_name] = portal
 
     def __getitem__(self, key):
-        return self._destination_region_lookup[key]
+        world = self._from_region.world
+        portal_index = world.map.portal_between(self._from_region.index, world.map.index[key])
+        if portal_index < 0:
+            raise KeyError(key)
+        return world.portals[portal_index]
 
     def __iter__(self):
-        for portal in self._portals:
-            yield portal
+        world = self._from_region.world
+        for portal_index in world.map.region_portals[self._from_region.index]:
+            yield world.portals[portal_index]
 
     def __len__(self):
-        return len(self._portals)
+        return len(self._from_region.world.map.region_portals[self._from_region.index])
 
     def __str__(self):
-        return "Portals from %s: %s" % (self._from_region, [str(portal) for portal in self._portals])
+        return "Portals from %s: %s" % (self._from_region, [str(portal) for portal in self])
 
 class Person(Thing):
+    __slots__ = ()
+
     def __init__(self, names, moveable=False, **kwargs):
         super().__init__(names=names)
         self._moveable = moveable
@@ -263,6 +548,8 @@ class Person(Thing):
     def __str__(self):
         return str(self.id)
 
+THING_TYPES = {cls.__name__: cls for cls in [Thing, Wand, Paper, Person]}
+
 class Regions(Mapping):
     def __init__(self):
         self._regions = []
@@ -276,6 +563,10 @@ class Regions(Mapping):
     def __getitem__(self, key):
         return self._region_lookup[key]
 
+    def at(self, index):
+        """ region by its index in the compiled map """
+        return self._regions[index]
+
     def __iter__(self):
         for region in self._regions:
             yield region
@@ -283,86 +574,995 @@ class Regions(Mapping):
     def __len__(self):
         return len(self._regions)
 
+def cache_path(path, suffix):
+    """ where the precompiled cache for the file at path (with suffix) lives """
+    directory, filename = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, CACHE_DIR, filename + suffix)
+
+def write_cache(path_to_cache, data):
+    try:
+        os.makedirs(os.path.dirname(path_to_cache), exist_ok=True)
+        tmp_path = "%s.%s.tmp" % (path_to_cache, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path_to_cache)
+    except OSError:
+        # an unwritable cache just means we rebuild next time
+        pass
+
+def load_cached(path, suffix, version, build):
+    """ return build(), cached on disk until the file at path (or version) changes """
+    source = os.stat(path)
+    signature = (version, source.st_size, source.st_mtime_ns)
+    path_to_cache = cache_path(path, suffix)
+    try:
+        with open(path_to_cache, 'rb') as f:
+            cached_signature, payload = pickle.load(f)
+        if cached_signature == signature:
+            return payload
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+        pass
+    payload = build()
+    write_cache(path_to_cache, pickle.dumps((signature, payload), pickle.HIGHEST_PROTOCOL))
+    return payload
+
+class PackedArrays:
+    """ typed arrays (array typecodes, "B" for byte strings) packed into one cache file
+
+    Loaded shared, the file is mapped read-only rather than read, so
+    nothing is copied or unpickled, and every process mapping it (say
+    the workers of a batch run) shares the same pages of the OS page
+    cache: the arrays are in memory once however many processes use
+    them. Sections start on 8 byte boundaries so they can be cast to
+    any typecode in place. """
+
+    _MAGIC = b"ZQPA1\0\0\0"
+    _HEADER = struct.Struct("<8sIIQQ")
+    _SECTION = struct.Struct("<c7xQQ")
+
+    def __init__(self, buffer, sections):
+        self._buffer = buffer
+        self._sections = sections
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """ PackedArrays holding arrays in memory, backed by no file """
+        return cls._from_bytes(cls._to_bytes(arrays))
+
+    @classmethod
+    def load(cls, path, suffix, version, build, shared=True):
+        """ PackedArrays of the arrays build() returns, cached on disk until the file at path (or version) changes """
+        source = os.stat(path)
+        signature = (version, source.st_size, source.st_mtime_ns)
+        path_to_cache = cache_path(path, suffix)
+        packed = cls._read(path_to_cache, signature, shared)
+        if packed is None:
+            data = cls._to_bytes(build(), signature)
+            write_cache(path_to_cache, data)
+            # map what we just wrote, so this process shares it too
+            packed = cls._read(path_to_cache, signature, shared) or cls._from_bytes(data, signature)
+        return packed
+
+    @classmethod
+    def sections(cls, path, suffix, version):
+        """ (typecode, length) of each array in the up to date cache of path, from its header alone (None if no such cache) """
+        try:
+            source = os.stat(path)
+            with open(cache_path(path, suffix), 'rb') as f:
+                header = f.read(cls._HEADER.size)
+                if len(header) < cls._HEADER.size:
+                    return None
+                magic, cached_version, n, size, mtime_ns = cls._HEADER.unpack(header)
+                if magic != cls._MAGIC or (cached_version, size, mtime_ns) != (version, source.st_size, source.st_mtime_ns):
+                    return None
+                table = f.read(n * cls._SECTION.size)
+        except OSError:
+            return None
+        if len(table) < n * cls._SECTION.size:
+            return None
+        sections = []
+        for typecode, offset, length in cls._SECTION.iter_unpack(table):
+            typecode = typecode.decode("ascii")
+            sections.append((typecode, length // array(typecode).itemsize))
+        return sections
+
+    @classmethod
+    def _read(cls, path_to_cache, signature, shared):
+        try:
+            with open(path_to_cache, 'rb') as f:
+                if shared:
+                    buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                else:
+                    buffer = f.read()
+        except (OSError, ValueError):
+            # ValueError: mapping an empty file
+            return None
+        return cls._from_bytes(buffer, signature)
+
+    @classmethod
+    def _from_bytes(cls, buffer, signature=(0, 0, 0)):
+        if len(buffer) < cls._HEADER.size:
+            return None
+        magic, version, n, size, mtime_ns = cls._HEADER.unpack_from(buffer)
+        if magic != cls._MAGIC or (version, size, mtime_ns) != signature:
+            return None
+        if len(buffer) < cls._HEADER.size + n * cls._SECTION.size:
+            return None
+        sections = []
+        for i in range(n):
+            typecode, offset, length = cls._SECTION.unpack_from(buffer, cls._HEADER.size + i * cls._SECTION.size)
+            if offset + length > len(buffer):
+                return None
+            sections.append((typecode.decode("ascii"), offset, length))
+        return cls(buffer, sections)
+
+    @classmethod
+    def _to_bytes(cls, arrays, signature=(0, 0, 0)):
+        version, size, mtime_ns = signature
+        parts = [cls._HEADER.pack(cls._MAGIC, version, len(arrays), size, mtime_ns)]
+        offset = cls._HEADER.size + len(arrays) * cls._SECTION.size
+        data = []
+        for values in arrays:
+            typecode = values.typecode if isinstance(values, array) else "B"
+            values = values.tobytes() if isinstance(values, array) else bytes(values)
+            padding = -offset % 8
+            offset += padding
+            parts.append(cls._SECTION.pack(typecode.encode("ascii"), offset, len(values)))
+            data += [bytes(padding), values]
+            offset += len(values)
+        return b"".join(parts + data)
+
+    def array(self, i):
+        """ the i-th array, as a read-only memoryview in place """
+        typecode, offset, length = self._sections[i]
+        return memoryview(self._buffer)[offset:offset + length].cast(typecode)
+
+    def blob(self, i):
+        """ (buffer, offset) of the i-th byte string; slicing the buffer gives bytes """
+        typecode, offset, length = self._sections[i]
+        return self._buffer, offset
+
+class WordStore(Set):
+    """ sorted, packed, read-only store of valid thing strings
+
+    Words are kept upper-cased and utf-8 encoded in a single buffer with
+    an array of offsets into it, so membership is a binary search and
+    loading a precompiled cache is mapping one file (see PackedArrays),
+    shared with every other process that has it mapped.
+
+    The binary search costs about 9µs a lookup, against about 0.1µs for
+    a set. That is the price of sharing; a store that is not shared
+    (with_set) builds a frozenset of its words on the first lookup and
+    answers from that, at the cost of a private copy of every word. """
+
+    VERSION = 2
+
+    def __init__(self, blob=b"", offsets=None, base=0, with_set=False):
+        self._blob = blob
+        self._offsets = offsets if offsets is not None else array("I", [0])
+        # where the words start in blob
+        self._base = base
+        self._with_set = with_set
+        self._set = None
+
+    @classmethod
+    def from_words(cls, words):
+        encoded = sorted(set(word.upper().encode("utf-8") for word in words))
+        offsets = array("I", [0])
+        for word in encoded:
+            offsets.append(offsets[-1] + len(word))
+        return cls(b"".join(encoded), offsets)
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, 'r') as f:
+            return cls.from_words(line.rstrip() for line in f)
+
+    @classmethod
+    def from_packed(cls, packed, first=0, with_set=False):
+        """ the store held in sections first (offsets) and first + 1 (words) of PackedArrays packed """
+        blob, base = packed.blob(first + 1)
+        return cls(blob, packed.array(first), base, with_set)
+
+    def to_arrays(self):
+        """ the offsets and the words, for PackedArrays """
+        return [self._offsets, self._blob[self._base:self._base + self._offsets[-1]]]
+
+    @classmethod
+    def load(cls, path, shared=True):
+        """ load the word list at path, using (and refreshing) its precompiled cache """
+        return cls.from_packed(PackedArrays.load(path, ".words", cls.VERSION, lambda: cls.from_file(path).to_arrays(), shared),
+                               with_set=not shared)
+
+    @classmethod
+    def index_version(cls, version):
+        """ the cache version for an index of this store's words (or word numbers) at version
+
+        Folds in the store's own VERSION, so changing how words are
+        normalised or ordered also invalidates every index built on them. """
+        return cls.VERSION << 16 | version
+
+    @classmethod
+    def cached_count(cls, path):
+        """ how many words the up to date cache of path holds, from its header alone (None if no such cache) """
+        sections = PackedArrays.sections(path, ".words", cls.VERSION)
+        if sections is None:
+            return None
+        return sections[0][1] - 1
+
+    def _word_bytes(self, i):
+        return self._blob[self._base + self._offsets[i]:self._base + self._offsets[i + 1]]
+
+    def find(self, key):
+        """ the number of the word with utf-8 encoding key, or -1 """
+        blob, offsets, base = self._blob, self._offsets, self._base
+        lo, hi = 0, len(offsets) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            word = blob[base + offsets[mid]:base + offsets[mid + 1]]
+            if word < key:
+                lo = mid + 1
+            elif word > key:
+                hi = mid
+            else:
+                return mid
+        return -1
+
+    def __contains__(self, string):
+        if not isinstance(string, str):
+            return False
+        if self._with_set:
+            if self._set is None:
+                self._set = frozenset(self)
+            return string in self._set
+        return self.find(string.encode("utf-8")) >= 0
+
+    def word(self, i):
+        """ the i-th word in sorted order """
+        return self._word_bytes(i).decode("utf-8")
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._word_bytes(i).decode("utf-8")
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+# Rough grapheme-to-sound rules, tried longest first at each position.
+# Only needs to be good enough to line up words that rhyme from the
+# second sound onwards (OCEAN/POTION, BOSS/SAUCE, ANSWER/CANCER).
+_GRAPHEME_SOUNDS = {
+    "TION": ("SH", "UN"), "SION": ("SH", "UN"), "CEAN": ("SH", "UN"), "CIAN": ("SH", "UN"),
+    "SWER": ("S", "ER"), "EIGH": ("AY",),
+    "TCH": ("CH",), "DGE": ("J",), "IGH": ("IY",), "EAU": ("OH",), "OUR": ("OW", "ER"),
+    "PH": ("F",), "SH": ("SH",), "CH": ("CH",), "TH": ("TH",), "CK": ("K",), "QU": ("K", "W"),
+    "WH": ("W",), "GH": (), "AU": ("O",), "AW": ("O",), "OA": ("OH",), "OU": ("OW",), "OW": ("OW",),
+    "EE": ("EE",), "EA": ("EE",), "IE": ("EE",), "AI": ("AY",), "AY": ("AY",), "EY": ("AY",),
+    "OO": ("OO",), "OI": ("OY",), "OY": ("OY",), "ER": ("ER",), "IR": ("ER",), "UR": ("ER",),
+    "X": ("K", "S"), "Q": ("K",), "Y": ("IY",),
+}
+_INITIAL_GRAPHEME_SOUNDS = {"WR": ("R",), "KN": ("N",), "GN": ("N",), "PS": ("S",), "Y": ("Y",)}
+_SOFTENING_VOWELS = "EIY"
+_VOWELS = "AEIOUY"
+_LONGEST_GRAPHEME = max(len(grapheme) for grapheme in _GRAPHEME_SOUNDS)
+
+def phonetic_sounds(word):
+    """ approximate sequence of sounds in word, e.g. OCEAN -> ('O', 'SH', 'UN') """
+    letters = "".join(c for c in word.upper() if c.isalpha())
+    if len(letters) > 3 and letters.endswith("E") and letters[-2] not in _VOWELS:
+        # silent final E (STONE), which still softens a C or G before it (SAUCE, PAGE)
+        letters = letters[:-2] + {"C": "S", "G": "J"}.get(letters[-2], letters[-2])
+    sounds = []
+    i = 0
+    while i < len(letters):
+        for length in range(min(_LONGEST_GRAPHEME, len(letters) - i), 0, -1):
+            grapheme = letters[i:i + length]
+            if i == 0 and grapheme in _INITIAL_GRAPHEME_SOUNDS:
+                grapheme_sounds = _INITIAL_GRAPHEME_SOUNDS[grapheme]
+                break
+            if grapheme in _GRAPHEME_SOUNDS:
+                grapheme_sounds = _GRAPHEME_SOUNDS[grapheme]
+                break
+        else:
+            letter = letters[i]
+            following = letters[i + 1:i + 2]
+            if letter == "C":
+                grapheme_sounds = ("S",) if following and following in _SOFTENING_VOWELS else ("K",)
+            elif letter == "G" and following and following in _SOFTENING_VOWELS:
+                grapheme_sounds = ("J",)
+            else:
+                grapheme_sounds = (letter,)
+            length = 1
+        for sound in grapheme_sounds:
+            # double letters (BOSS, APPLE) make a single sound
+            if not sounds or sounds[-1] != sound or sound in _VOWELS:
+                sounds.append(sound)
+        i += length
+    return tuple(sounds)
+
+class PhoneticIndex:
+    """ valid things indexed by the sounds following their leading sound
+
+    Two things related by changing the leading sound share a tail; a
+    thing that adds a leading sound to X has a tail equal to all of X's
+    sounds. Either way the answer is a single lookup: the tails are a
+    WordStore of their own, and the words sharing tail number t are
+    numbers[groups[t]:groups[t + 1]] of the WordStore words. """
+
+    VERSION = 2
+
+    def __init__(self, words, packed=None):
+        self._words = words
+        if packed is None:
+            packed = PackedArrays.from_arrays(self._build(words))
+        self._tails = WordStore.from_packed(packed)
+        self._groups = packed.array(2)
+        self._numbers = packed.array(3)
+
+    @classmethod
+    def _build(cls, words):
+        by_tail = dict()
+        for number, word in enumerate(words):
+            sounds = phonetic_sounds(word)
+            if len(sounds) > 1:
+                by_tail.setdefault(cls._key(sounds[1:]), []).append(number)
+        tails = WordStore.from_words(by_tail)
+        groups = array("I", [0])
+        numbers = array("I")
+        for tail in tails:
+            numbers.extend(by_tail[tail])
+            groups.append(len(numbers))
+        return tails.to_arrays() + [groups, numbers]
+
+    @classmethod
+    def load(cls, path, words, shared=True):
+        """ index for the WordStore words of the file at path, from its on-disk cache when up to date """
+        return cls(words, PackedArrays.load(path, ".phonetic", WordStore.index_version(cls.VERSION), lambda: cls._build(words), shared))
+
+    @staticmethod
+    def _key(sounds):
+        return " ".join(sounds)
+
+    def _sharing_tail(self, sounds):
+        t = self._tails.find(self._key(sounds).encode("utf-8"))
+        if t < 0:
+            return []
+        return [self._words.word(number) for number in self._numbers[self._groups[t]:self._groups[t + 1]]]
+
+    @staticmethod
+    def _boring_p(from_string, to_string):
+        # just adding or changing the first letter is not phonetic magic
+        return to_string[1:] in (from_string, from_string[1:])
+
+    def transformations(self, string):
+        """ valid things string can become by changing or adding a leading sound """
+        string = string.upper()
+        sounds = phonetic_sounds(string)
+        candidates = chain(self._sharing_tail(sounds[1:]) if len(sounds) > 1 else [],
+                           self._sharing_tail(sounds))
+        return sorted(set(candidate for candidate in candidates
+                          if candidate != string and not self._boring_p(string, candidate)))
+
+    def transformable_p(self, from_string, to_string):
+        """ can from_string become to_string by changing or adding a leading sound? """
+        from_string = from_string.upper()
+        to_string = to_string.upper()
+        if from_string == to_string or self._boring_p(from_string, to_string):
+            return False
+        from_sounds = phonetic_sounds(from_string)
+        to_sounds = phonetic_sounds(to_string)
+        if len(to_sounds) < 2:
+            return False
+        if to_sounds[1:] == from_sounds:
+            return True
+        return len(from_sounds) > 1 and to_sounds[1:] == from_sounds[1:] and to_sounds[0] != from_sounds[0]
+
+class NameScanner:
+    """ Aho-Corasick automaton finding every occurrence of a set of names, embedded or not, in one pass
+
+    State 0 is the root; _goto[state] maps a letter to the next state,
+    _fail[state] is the state for the longest proper suffix that is
+    also a prefix of some name, and _output[state] holds the names
+    ending there (including those reached through fail links). """
+
+    def __init__(self, names):
+        self._goto = [dict()]
+        self._output = [()]
+        for name in dict.fromkeys(names):
+            state = 0
+            for letter in name:
+                if letter not in self._goto[state]:
+                    self._goto.append(dict())
+                    self._output.append(())
+                    self._goto[state][letter] = len(self._goto) - 1
+                state = self._goto[state][letter]
+            self._output[state] += (name,)
+        self._fail = [0] * len(self._goto)
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for letter, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and letter not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(letter, 0)
+                self._fail[next_state] = fail
+                self._output[next_state] += self._output[fail]
+
+    def scan(self, text):
+        """ (start, name) for every occurrence of every name in text, in order of where they end """
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        for i, letter in enumerate(text):
+            while state and letter not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(letter, 0)
+            for name in output[state]:
+                yield (i + 1 - len(name), name)
+
+    def names_in(self, text):
+        """ the distinct names hidden in text, sorted """
+        return tuple(sorted(set(name for start, name in self.scan(text.upper()))))
+
+HIDDEN_NAMES = NameScanner(ZODIACS + GEMS)
+
+class HiddenNameIndex:
+    """ the zodiac and gem names hidden in each valid thing
+
+    Built by scanning the whole word list in one pass (words joined by
+    newlines, which no name contains) and cached on disk, so questions
+    like "which valid things contain a zodiac?" are lookups. """
+
+    VERSION = 1
+
+    def __init__(self, words, scanner=HIDDEN_NAMES):
+        words = list(words)
+        starts = []
+        offset = 0
+        for word in words:
+            starts.append(offset)
+            offset += len(word) + 1
+        self._hits = dict()
+        self._words_by_name = dict()
+        for start, name in scanner.scan("\n".join(words)):
+            word = words[bisect_right(starts, start) - 1]
+            hits = self._hits.get(word, ())
+            if name not in hits:
+                self._hits[word] = tuple(sorted(hits + (name,)))
+                self._words_by_name.setdefault(name, []).append(word)
+
+    @classmethod
+    def load(cls, path, words):
+        """ index for the word list at path, from its on-disk cache when up to date """
+        return load_cached(path, ".hidden", WordStore.index_version(cls.VERSION), lambda: cls(words))
+
+    def hits(self, word):
+        """ the zodiac and gem names hidden in a valid thing (empty if none, or not a valid thing) """
+        return self._hits.get(word.upper(), ())
+
+    def words_containing(self, name):
+        """ valid things with name hidden in them """
+        return list(self._words_by_name.get(name.upper(), []))
+
+    @property
+    def zodiac_words(self):
+        """ valid things with any zodiac name hidden in them """
+        return sorted(set(chain.from_iterable(self._words_by_name.get(name, []) for name in ZODIAC_NAMES)))
+
+    @property
+    def gem_words(self):
+        """ valid things with any gem name hidden in them """
+        return sorted(set(chain.from_iterable(self._words_by_name.get(name, []) for name in GEM_NAMES)))
+
+def edit_distance(a, b):
+    """ the fewest single letter insertions, deletions, changes or swaps of neighbours turning a into b
+
+    (Optimal string alignment: Levenshtein distance, plus swapping two
+    adjacent letters counting as one edit, as typing them the wrong
+    way round is the commonest typo.) """
+    two_above, above = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        row = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            row[j] = min(above[j] + 1, row[j - 1] + 1, above[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                row[j] = min(row[j], two_above[j - 2] + 1)
+        two_above, above = above, row
+    return above[-1]
+
+def typo_allowance(string):
+    """ how many edits away a "did you mean" suggestion for string may be (none for very short strings) """
+    if len(string) <= 2:
+        return 0
+    return 1 if len(string) <= 5 else 2
+
+def closest(matches, limit=5):
+    """ the strings of the nearest (distance, string) matches """
+    if not matches:
+        return []
+    nearest = min(distance for distance, string in matches)
+    return sorted(string for distance, string in matches if distance == nearest)[:limit]
+
+class DeletionIndex:
+    """ symmetric deletion index over the valid things, for "did you mean" suggestions
+
+    Holds a sorted array of crc32(variant) << WORD_BITS | word number,
+    for each word and each variant of it with one letter deleted. The
+    words within one edit of a string are those sharing a variant with
+    it (a swap of neighbours included: deleting either letter of the
+    pair leaves the same variant); the words within two edits are those
+    within one edit of some string one edit away, so a wider search
+    probes through those too.
+    A few thousand binary searches replace a pass over every word, and
+    as every candidate is checked with edit_distance, hash collisions
+    cost time but never wrong answers. """
+
+    VERSION = 2
+    WORD_BITS = 20
+
+    def __init__(self, words, packed=None):
+        if packed is None:
+            packed = PackedArrays.from_arrays(self._build(words))
+        self._entries = packed.array(0)
+        self._letters = bytes(packed.array(1))
+        self._words = words
+
+    @classmethod
+    def _build(cls, words):
+        # word numbers share each entry with a hash, in WORD_BITS bits
+        assert len(words) < 1 << cls.WORD_BITS, "too many words for %s.WORD_BITS" % cls.__name__
+        entries = []
+        letters = set()
+        for number, word in enumerate(words):
+            key = word.encode("utf-8")
+            letters.update(key)
+            for variant in cls._deletes(key):
+                entries.append(zlib.crc32(variant) << cls.WORD_BITS | number)
+        entries.sort()
+        return [array("Q", entries), bytes(sorted(letters))]
+
+    @classmethod
+    def load(cls, path, words, shared=True):
+        """ index for the WordStore words of the file at path, from its on-disk cache when up to date """
+        return cls(words, PackedArrays.load(path, ".deletions", WordStore.index_version(cls.VERSION), lambda: cls._build(words), shared))
+
+    @staticmethod
+    def _deletes(key):
+        return set([key] + [key[:i] + key[i + 1:] for i in range(len(key))])
+
+    def _edits(self, key):
+        edits = self._deletes(key)
+        for i in range(len(key) - 1):
+            edits.add(key[:i] + key[i + 1:i + 2] + key[i:i + 1] + key[i + 2:])
+        for i in range(len(key) + 1):
+            for letter in self._letters:
+                edits.add(key[:i] + bytes([letter]) + key[i:])
+                if i < len(key):
+                    edits.add(key[:i] + bytes([letter]) + key[i + 1:])
+        return edits
+
+    def near(self, string, max_distance=2):
+        """ (distance, word) for each word within max_distance (at most 2) edits of string, nearest first """
+        string = string.upper()
+        key = string.encode("utf-8")
+        sources = self._edits(key) if max_distance > 1 else [key]
+        probes = set()
+        for source in sources:
+            probes.update(self._deletes(source))
+        entries = self._entries
+        mask = (1 << self.WORD_BITS) - 1
+        numbers = set()
+        for probe in probes:
+            crc = zlib.crc32(probe)
+            i = bisect_left(entries, crc << self.WORD_BITS)
+            while i < len(entries) and entries[i] >> self.WORD_BITS == crc:
+                numbers.add(entries[i] & mask)
+                i += 1
+        found = []
+        for number in numbers:
+            word = self._words.word(number)
+            if abs(len(word) - len(string)) <= max_distance:
+                distance = edit_distance(string, word)
+                if distance <= max_distance:
+                    found.append((distance, word))
+        found.sort()
+        return found
+
+class WordGraph:
+    """ word ladders and anagrams over the valid things
+
+    Two things are neighbours when one letter changes, is added or is
+    taken away (CANCER, CANTER, CANTOR...). Every word goes in the
+    wildcard buckets of its letters (C?NCER, CA?CER...) and of its gaps
+    (?CANCER, C?ANCER...); a word's neighbours are in the letter buckets
+    it is in, as the same bucket's letters (a changed letter) or gaps (a
+    letter taken away), and in its gap buckets as letters (a letter
+    added). Anagrams share their sorted letters. Like DeletionIndex,
+    each bucket is a run of a sorted array of crc32(key) << 21 | gap
+    << 20 | word number, and every candidate is checked against the
+    key, so collisions cost time but never wrong answers. """
+
+    VERSION = 1
+    WORD_BITS = 20
+
+    def __init__(self, words, packed=None):
+        if packed is None:
+            packed = PackedArrays.from_arrays(self._build(words))
+        self._buckets = packed.array(0)
+        self._anagrams = packed.array(1)
+        self._words = words
+
+    @classmethod
+    def _build(cls, words):
+        assert len(words) < 1 << cls.WORD_BITS, "too many words for %s.WORD_BITS" % cls.__name__
+        buckets = []
+        anagrams = []
+        gap = 1 << cls.WORD_BITS
+        for number, word in enumerate(words):
+            for key in cls._letter_keys(word):
+                buckets.append(zlib.crc32(key.encode("utf-8")) << cls.WORD_BITS + 1 | number)
+            for key in cls._gap_keys(word):
+                buckets.append(zlib.crc32(key.encode("utf-8")) << cls.WORD_BITS + 1 | gap | number)
+            anagrams.append(zlib.crc32(cls._anagram_key(word).encode("utf-8")) << cls.WORD_BITS | number)
+        buckets.sort()
+        anagrams.sort()
+        return [array("Q", buckets), array("Q", anagrams)]
+
+    @classmethod
+    def load(cls, path, words, shared=True):
+        """ graph over the WordStore words of the file at path, from its on-disk cache when up to date """
+        return cls(words, PackedArrays.load(path, ".graph", WordStore.index_version(cls.VERSION), lambda: cls._build(words), shared))
+
+    @staticmethod
+    def _letter_keys(word):
+        return [word[:i] + "?" + word[i + 1:] for i in range(len(word))]
+
+    @staticmethod
+    def _gap_keys(word):
+        return [word[:i] + "?" + word[i:] for i in range(len(word) + 1)]
+
+    @staticmethod
+    def _anagram_key(word):
+        return "".join(sorted(word))
+
+    def _run(self, entries, bits, key):
+        # the entries for key: those whose top bits are its crc32
+        crc = zlib.crc32(key.encode("utf-8"))
+        i = bisect_left(entries, crc << bits)
+        while i < len(entries) and entries[i] >> bits == crc:
+            yield entries[i]
+            i += 1
+
+    def _bucket(self, key, gap):
+        """ words in the letter (gap 0) or gap (gap 1) bucket key """
+        mask = (1 << self.WORD_BITS) - 1
+        return [self._words.word(entry & mask) for entry in self._run(self._buckets, self.WORD_BITS + 1, key)
+                if entry >> self.WORD_BITS & 1 == gap]
+
+    def neighbours(self, word):
+        """ valid things one letter changed, added or taken away from word """
+        word = word.upper()
+        found = set()
+        for i, key in enumerate(self._letter_keys(word)):
+            found.update(other for other in self._bucket(key, 0) if other[:i] + "?" + other[i + 1:] == key)
+            found.update(other for other in self._bucket(key, 1) if other[:i] + "?" + other[i:] == key)
+        for i, key in enumerate(self._gap_keys(word)):
+            found.update(other for other in self._bucket(key, 0) if other[:i] + "?" + other[i + 1:] == key)
+        found.discard(word)
+        return sorted(found)
+
+    def anagrams(self, word):
+        """ other valid things with exactly the letters of word """
+        word = word.upper()
+        key = self._anagram_key(word)
+        mask = (1 << self.WORD_BITS) - 1
+        found = set(self._words.word(entry & mask) for entry in self._run(self._anagrams, self.WORD_BITS, key))
+        return sorted(other for other in found if other != word and self._anagram_key(other) == key)
+
+    def _steps(self, word, with_anagrams):
+        return self.neighbours(word) + self.anagrams(word) if with_anagrams else self.neighbours(word)
+
+    def ladder(self, from_word, to_word, with_anagrams=False, max_steps=None):
+        """ shortest chain of valid things from from_word to to_word, each a neighbour (or, with_anagrams, an anagram)
+        of the one before, or None if there is none (within max_steps steps)
+
+        A bidirectional breadth first search: each round grows whichever
+        side's frontier is smaller by one step, until the two meet. """
+        from_word, to_word = from_word.upper(), to_word.upper()
+        if from_word == to_word:
+            return [from_word]
+        # each side maps the words it has reached to the word it reached them from
+        parents = [{from_word: None}, {to_word: None}]
+        frontiers = [[from_word], [to_word]]
+        steps = 0
+        while frontiers[0] and frontiers[1] and (max_steps is None or steps < max_steps):
+            side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+            reached, other = parents[side], parents[1 - side]
+            frontier = []
+            meeting = None
+            for word in frontiers[side]:
+                for step in self._steps(word, with_anagrams):
+                    if step in reached:
+                        continue
+                    reached[step] = word
+                    if step in other:
+                        meeting = step
+                        break
+                    frontier.append(step)
+                if meeting is not None:
+                    break
+            steps += 1
+            if meeting is not None:
+                chain = [meeting]
+                while parents[0][chain[0]] is not None:
+                    chain.insert(0, parents[0][chain[0]])
+                while parents[1][chain[-1]] is not None:
+                    chain.append(parents[1][chain[-1]])
+                return chain
+            frontiers[side] = frontier
+        return None
+
+class BKTree:
+    """ strings arranged by edit distance, so those near a string are found without comparing against all of them
+
+    Each node is (string, {distance: child}); by the triangle
+    inequality only children whose distance is within max_distance of
+    the query's distance to the node can hold matches. """
+
+    def __init__(self, strings=()):
+        self._root = None
+        for string in strings:
+            self.add(string)
+
+    def add(self, string):
+        if self._root is None:
+            self._root = (string, dict())
+            return
+        node = self._root
+        while True:
+            distance = edit_distance(string, node[0])
+            if distance == 0:
+                return
+            if distance not in node[1]:
+                node[1][distance] = (string, dict())
+                return
+            node = node[1][distance]
+
+    def near(self, string, max_distance=2):
+        """ (distance, string) for each string within max_distance edits, nearest first """
+        found = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node_string, children = stack.pop()
+            distance = edit_distance(string, node_string)
+            if distance <= max_distance:
+                found.append((distance, node_string))
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        found.sort()
+        return found
+
+class WorldMap:
+    """ the map (regions, portals, starting things) compiled from a declarative file
+
+    Regions get integer indices; portals and costs become flat n*n
+    matrices (row-major, 0 where there is no portal) for the listed and
+    gem cost models, plus the portal index between each pair of regions
+    (-1 where there is none). Region and Portal objects are views onto
+    these arrays, which are shared by every World made from the map. """
+
+    def __init__(self, definition):
+        regions = definition["regions"]
+        self.n = len(regions)
+        self.ids = [sys.intern(region["id"]) for region in regions]
+        self.names = [sys.intern(region["name"]) for region in regions]
+        self.pages = [region.get("page") for region in regions]
+        self.monuments = [region.get("monument") for region in regions]
+        self.index = dict()
+        for i, region in enumerate(regions):
+            self.index[region["name"]] = i
+            self.index[region["id"]] = i
+        n = self.n
+        self.portal_a = array("i")
+        self.portal_b = array("i")
+        self.portal_costs = array("i")
+        self.cost = array("i", [0]) * (n * n)
+        self.gem_cost = array("i", [0]) * (n * n)
+        self.portal_at = array("i", [-1]) * (n * n)
+        self.region_portals = [[] for _ in range(n)]
+        for portal_index, portal in enumerate(definition["portals"]):
+            a, b = [self.index[key] for key in portal["between"]]
+            listed_cost = portal["cost"]
+            self.portal_a.append(a)
+            self.portal_b.append(b)
+            self.portal_costs.append(listed_cost)
+            for i, j in [(a, b), (b, a)]:
+                self.cost[i * n + j] = listed_cost
+                self.gem_cost[i * n + j] = portal_cost(listed_cost, True)
+                self.portal_at[i * n + j] = portal_index
+                self.region_portals[i].append(portal_index)
+        self.region_portals = [tuple(portals) for portals in self.region_portals]
+        self.things = list(definition.get("things", []))
+        self._name_index = None
+
+    @property
+    def name_index(self):
+        """ BKTree of the region names and ids, built on first use """
+        if self._name_index is None:
+            self._name_index = BKTree(chain(self.names, self.ids))
+        return self._name_index
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as f:
+            return cls(json.load(f))
+
+    def cost_matrix(self, have_gem=False):
+        """ flat n*n portal costs for one cost model (0 where there is no portal)
+
+        An array("i"), so it can be shared without copying as e.g.
+        numpy.frombuffer(m, dtype=numpy.intc).reshape(n, n). """
+        return self.gem_cost if have_gem else self.cost
+
+    def portal_between(self, i, j):
+        return self.portal_at[i * self.n + j]
+
+class RouteTable:
+    """ cheapest routes between every pair of regions for one portal cost model
+
+    Built once with Floyd-Warshall over the map's cost matrix (the map
+    is small), after which the cost and path for any pair are lookups. """
+
+    def __init__(self, world_map, have_gem):
+        n = world_map.n
+        portal_costs = world_map.cost_matrix(have_gem)
+        cost = [None] * (n * n)
+        next_hop = [None] * (n * n)
+        for a in range(n):
+            cost[a * n + a] = 0
+            next_hop[a * n + a] = a
+            for b in range(n):
+                if portal_costs[a * n + b]:
+                    cost[a * n + b] = portal_costs[a * n + b]
+                    next_hop[a * n + b] = b
+        for k in range(n):
+            for a in range(n):
+                a_to_k = cost[a * n + k]
+                if a_to_k is None:
+                    continue
+                for b in range(n):
+                    k_to_b = cost[k * n + b]
+                    if k_to_b is None:
+                        continue
+                    if cost[a * n + b] is None or a_to_k + k_to_b < cost[a * n + b]:
+                        cost[a * n + b] = a_to_k + k_to_b
+                        next_hop[a * n + b] = next_hop[a * n + k]
+        ids = world_map.ids
+        self._index = world_map.index
+        self._n = n
+        self._cost = cost
+        self._paths = dict()
+        for a in range(n):
+            for b in range(n):
+                if next_hop[a * n + b] is not None:
+                    path = [a]
+                    while path[-1] != b:
+                        path.append(next_hop[path[-1] * n + b])
+                    self._paths[(a, b)] = [ids[i] for i in path]
+        # regions sorted by cost from each region, so reachability is a prefix
+        self._by_cost = [sorted((cost[a * n + b], ids[b]) for b in range(n) if cost[a * n + b] is not None)
+                         for a in range(n)]
+
+    def cost(self, from_id, to_id):
+        """ cheapest cost from one region to another, or None if unreachable """
+        return self._cost[self._index[from_id] * self._n + self._index[to_id]]
+
+    def path(self, from_id, to_id):
+        """ region ids along the cheapest route (inclusive), or None if unreachable """
+        return self._paths.get((self._index[from_id], self._index[to_id]))
+
+    def reachable(self, from_id, coins):
+        """ (cost, region id) for every region reachable with coins """
+        reachable = []
+        for cost, region_id in self._by_cost[self._index[from_id]]:
+            if cost > coins:
+                break
+            reachable.append((cost, region_id))
+        return reachable
+
+class Dictionary:
+    """ the valid things and the indexes derived from them
+
+    Loaded once and shared by every World built from it (see
+    World.new_game), since none of it changes during a game. With
+    shared, the words and the phonetic, deletion and word graph indexes are mapped
+    from their caches (see PackedArrays), so processes using the same
+    dictionary share one copy of them; otherwise each process reads
+    its own. Pickling keeps only the path, and an unpickled Dictionary
+    attaches to the caches afresh. """
+
+    def __init__(self, path="9C.txt", shared=True):
+        self.path = path
+        self.shared = shared
+        self._words = None
+        self._words_lock = threading.Lock()
+        self._phonetic_index = None
+        self._hidden_name_index = None
+        self._deletion_index = None
+        self._word_graph = None
+
+    @property
+    def words(self):
+        """ WordStore of the valid things, loaded on first use (waiting for preload if it is under way) """
+        if self._words is None:
+            with self._words_lock:
+                if self._words is None:
+                    self._words = WordStore.load(self.path, self.shared)
+        return self._words
+
+    def preload(self):
+        """ start loading the words in a background thread, so the first lookup need not wait for them """
+        if self._words is None:
+            threading.Thread(target=lambda: self.words, daemon=True).start()
+
+    @property
+    def count(self):
+        """ how many valid things there are, from the cache header if the words are not loaded yet """
+        if self._words is None:
+            count = WordStore.cached_count(self.path)
+            if count is not None:
+                return count
+        return len(self.words)
+
+    @property
+    def phonetic_index(self):
+        """ PhoneticIndex over the valid things, built (or loaded from cache) on first use """
+        if self._phonetic_index is None:
+            self._phonetic_index = PhoneticIndex.load(self.path, self.words, self.shared)
+        return self._phonetic_index
+
+    @property
+    def hidden_name_index(self):
+        """ HiddenNameIndex over the valid things, built (or loaded from cache) on first use """
+        if self._hidden_name_index is None:
+            self._hidden_name_index = HiddenNameIndex.load(self.path, self.words)
+        return self._hidden_name_index
+
+    @property
+    def deletion_index(self):
+        """ DeletionIndex over the valid things, built (or loaded from cache) on first use """
+        if self._deletion_index is None:
+            self._deletion_index = DeletionIndex.load(self.path, self.words, self.shared)
+        return self._deletion_index
+
+    def near(self, string, max_distance=2):
+        """ (distance, valid thing) for those within max_distance edits of string, nearest first """
+        return self.deletion_index.near(string, max_distance)
+
+    @property
+    def word_graph(self):
+        """ WordGraph of the valid things, built (or loaded from cache) on first use """
+        if self._word_graph is None:
+            self._word_graph = WordGraph.load(self.path, self.words, self.shared)
+        return self._word_graph
+
+    def __getstate__(self):
+        return (self.path, self.shared)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
 class World:
     def _construct_regions(self):
         self.regions = Regions()
-        # Page 1 regions
-        self.regions.add_region(Region(self, "YE OLD HOME TOWN", "A"))
-        self.regions.add_region(Region(self, "TRANSITION MEADOW", "B"))
-        self.regions.add_region(Region(self, "OPEN ZONE", "C"))
-        self.regions.add_region(Region(self, "TRANSITION GLEN", "D"))
-        self.regions.add_region(Region(self, "GARDENS OF IVES", "E"))
-        self.regions.add_region(Region(self, "MOUNTAIN HEIGHTS", "F"))
-        # Page 2 regions
-        self.regions.add_region(Region(self, "MAMMOTH REEF COVE", "G"))
-        self.regions.add_region(Region(self, "NORTHINGTON EAST", "H"))
-        self.regions.add_region(Region(self, "PINELANDS OF OUR GODDESS", "I"))
-        self.regions.add_region(Region(self, "ABANDONED PLAINS", "J"))
-        self.regions.add_region(Region(self, "LEIGHTON PASS", "K"))
-        self.regions.add_region(Region(self, "FOURIER PLAZA AT AMALFI VERDI", "L"))
-        # Page 3 regions
-        self.regions.add_region(Region(self, "STONESIDE VALLEY", "M"))
-        self.regions.add_region(Region(self, "MOTHER-OF-OUR-EARTH REEDSWAMP", "N"))
-        self.regions.add_region(Region(self, "GLADE OF SUNNINESS", "O"))
-        self.regions.add_region(Region(self, "REALM OF HONESTY", "P"))
-        self.regions.add_region(Region(self, "VELVET WOLD", "Q"))
-        # Page 4 regions
-        self.regions.add_region(Region(self, "LOST WOODS OF BALFOUR", "R"))
-        self.regions.add_region(Region(self, "LONELY HILLS", "S"))
-        self.regions.add_region(Region(self, "WILDERNESS EVENT PAVILION", "T"))
-        self.regions.add_region(Region(self, "SOUTHINGTON EAST", "U"))
+        for index in range(self.map.n):
+            self.regions.add_region(Region(self, index))
 
     def _construct_portals(self):
         self.portals = Portals()
-        # Page 1 Portals
-        self.portals.add_portal(Portal(self.regions["YE OLD HOME TOWN"], self.regions["TRANSITION MEADOW"], 1))
-        self.portals.add_portal(Portal(self.regions["YE OLD HOME TOWN"], self.regions["TRANSITION GLEN"], 1))
-        self.portals.add_portal(Portal(self.regions["TRANSITION MEADOW"], self.regions["GARDENS OF IVES"], 1))
-        self.portals.add_portal(Portal(self.regions["TRANSITION MEADOW"], self.regions["MOUNTAIN HEIGHTS"], 1))
-        self.portals.add_portal(Portal(self.regions["TRANSITION MEADOW"], self.regions["OPEN ZONE"], 1))
-        self.portals.add_portal(Portal(self.regions["TRANSITION GLEN"], self.regions["GARDENS OF IVES"], 1))
-        self.portals.add_portal(Portal(self.regions["GARDENS OF IVES"], self.regions["MOUNTAIN HEIGHTS"], 1))
-        self.portals.add_portal(Portal(self.regions["OPEN ZONE"], self.regions["MOUNTAIN HEIGHTS"], 2))
-        self.portals.add_portal(Portal(self.regions["OPEN ZONE"], self.regions["MAMMOTH REEF COVE"], 3))
-        self.portals.add_portal(Portal(self.regions["OPEN ZONE"], self.regions["PINELANDS OF OUR GODDESS"], 2))
-        self.portals.add_portal(Portal(self.regions["MOUNTAIN HEIGHTS"], self.regions["PINELANDS OF OUR GODDESS"], 1))
-        self.portals.add_portal(Portal(self.regions["MOUNTAIN HEIGHTS"], self.regions["ABANDONED PLAINS"], 1))
-        self.portals.add_portal(Portal(self.regions["MOUNTAIN HEIGHTS"], self.regions["LOST WOODS OF BALFOUR"], 3))
-        # Page 2 Portals
-        self.portals.add_portal(Portal(self.regions["MAMMOTH REEF COVE"], self.regions["NORTHINGTON EAST"], 2))
-        self.portals.add_portal(Portal(self.regions["MAMMOTH REEF COVE"], self.regions["PINELANDS OF OUR GODDESS"], 3))
-        self.portals.add_portal(Portal(self.regions["PINELANDS OF OUR GODDESS"], self.regions["NORTHINGTON EAST"], 2))
-        self.portals.add_portal(Portal(self.regions["PINELANDS OF OUR GODDESS"], self.regions["ABANDONED PLAINS"], 3))
-        self.portals.add_portal(Portal(self.regions["PINELANDS OF OUR GODDESS"], self.regions["LEIGHTON PASS"], 2))
-        self.portals.add_portal(Portal(self.regions["NORTHINGTON EAST"], self.regions["LEIGHTON PASS"], 3))
-        self.portals.add_portal(Portal(self.regions["NORTHINGTON EAST"], self.regions["FOURIER PLAZA AT AMALFI VERDI"], 3))
-        self.portals.add_portal(Portal(self.regions["ABANDONED PLAINS"], self.regions["LEIGHTON PASS"], 2))
-        self.portals.add_portal(Portal(self.regions["LEIGHTON PASS"], self.regions["FOURIER PLAZA AT AMALFI VERDI"], 2))
-        # Page 3 Portals
-        self.portals.add_portal(Portal(self.regions["TRANSITION GLEN"], self.regions["STONESIDE VALLEY"], 1))
-        self.portals.add_portal(Portal(self.regions["GARDENS OF IVES"], self.regions["MOTHER-OF-OUR-EARTH REEDSWAMP"], 2))
-        self.portals.add_portal(Portal(self.regions["MOUNTAIN HEIGHTS"], self.regions["MOTHER-OF-OUR-EARTH REEDSWAMP"], 3))
-        self.portals.add_portal(Portal(self.regions["MOUNTAIN HEIGHTS"], self.regions["REALM OF HONESTY"], 2))
-        self.portals.add_portal(Portal(self.regions["MOUNTAIN HEIGHTS"], self.regions["VELVET WOLD"], 1))
-        self.portals.add_portal(Portal(self.regions["MOUNTAIN HEIGHTS"], self.regions["GLADE OF SUNNINESS"], 1))
-        self.portals.add_portal(Portal(self.regions["STONESIDE VALLEY"], self.regions["MOTHER-OF-OUR-EARTH REEDSWAMP"], 1))
-        self.portals.add_portal(Portal(self.regions["STONESIDE VALLEY"], self.regions["REALM OF HONESTY"], 3))
-        self.portals.add_portal(Portal(self.regions["MOTHER-OF-OUR-EARTH REEDSWAMP"], self.regions["REALM OF HONESTY"], 2))
-        self.portals.add_portal(Portal(self.regions["REALM OF HONESTY"], self.regions["VELVET WOLD"], 1))
-        self.portals.add_portal(Portal(self.regions["VELVET WOLD"], self.regions["GLADE OF SUNNINESS"], 1))
-        # Page 4 Portals
-        self.portals.add_portal(Portal(self.regions["ABANDONED PLAINS"], self.regions["LOST WOODS OF BALFOUR"], 1))
-        self.portals.add_portal(Portal(self.regions["LEIGHTON PASS"], self.regions["LOST WOODS OF BALFOUR"], 2))
-        self.portals.add_portal(Portal(self.regions["LEIGHTON PASS"], self.regions["LONELY HILLS"], 2))
-        self.portals.add_portal(Portal(self.regions["FOURIER PLAZA AT AMALFI VERDI"], self.regions["LONELY HILLS"], 2))
-        self.portals.add_portal(Portal(self.regions["FOURIER PLAZA AT AMALFI VERDI"], self.regions["SOUTHINGTON EAST"], 1))
-        self.portals.add_portal(Portal(self.regions["GLADE OF SUNNINESS"], self.regions["LOST WOODS OF BALFOUR"], 2))
-        self.portals.add_portal(Portal(self.regions["LOST WOODS OF BALFOUR"], self.regions["LONELY HILLS"], 3))
-        self.portals.add_portal(Portal(self.regions["LOST WOODS OF BALFOUR"], self.regions["WILDERNESS EVENT PAVILION"], 2))
-        self.portals.add_portal(Portal(self.regions["LONELY HILLS"], self.regions["WILDERNESS EVENT PAVILION"], 3))
-        self.portals.add_portal(Portal(self.regions["LONELY HILLS"], self.regions["SOUTHINGTON EAST"], 2))
-        self.portals.add_portal(Portal(self.regions["GLADE OF SUNNINESS"], self.regions["WILDERNESS EVENT PAVILION"], 3))
-        self.portals.add_portal(Portal(self.regions["WILDERNESS EVENT PAVILION"], self.regions["SOUTHINGTON EAST"], 2))
+        for index in range(len(self.map.portal_costs)):
+            self.portals.add_portal(Portal(self, index))
 
     def phrontiersman_magic(you, from_thing_name, to_thing_name):
         # I use Magic to phonetically change whatever you’d like into
@@ -371,48 +1571,339 @@ class World:
         # or a BOSS into a SAUCE. (I never just add or change a single
         # letter while leaving the rest of the letters intact – that
         # would be a bit boring.)
-        if you.region.inventory.get(from_thing_name):
-            print("TODO: implement")
-#            if from_thing_name == "ANSWER" and to_thing_name == "CANCER":
-#                
-                
+        world = you.region.world
+        from_thing_name, to_thing_name = from_thing_name.upper(), to_thing_name.upper()
+        if not you.region_inventory.have_name_p("PHRONTIERSMAN"):
+            you.events.emit(Event("no_magician", name="PHRONTIERSMAN"))
+            return False
+        if you.inventory.get(from_thing_name):
+            inventory = you.inventory
+        elif you.region_inventory.get(from_thing_name):
+            inventory = you.changeable_region_inventory()
+        else:
+            you.events.emit(Event("nothing_to_transform", name=from_thing_name))
+            return False
+        things = inventory.get(from_thing_name)
+        if not world.valid_thing_p(to_thing_name):
+            you.events.emit(Event("not_a_thing", name=to_thing_name))
+            you._suggest(closest(world.dictionary.near(to_thing_name, typo_allowance(to_thing_name))))
+            return False
+        if not world.phonetic_index.transformable_p(from_thing_name, to_thing_name):
+            you.events.emit(Event("not_transformable", name=from_thing_name, to_name=to_thing_name))
+            return False
+        thing = inventory.remove(things[0])
+        if not thing:
+            you.events.emit(Event("not_moveable", thing=things[0]))
+            return False
+        inventory.add(Thing([to_thing_name]))
+        # the journal's deltas no longer match the inventories, and magic can't be taken back
+        you._journal.clear()
+        you.events.emit(Event("transformed", name=from_thing_name, to_name=to_thing_name))
+        return True
 
     def _construct_things(self):
-        r = self.regions["OPEN ZONE"]
-        r.inventory.add(Person(["PHRONTIERSMAN", "FIGURE"], magic=World.phrontiersman_magic))
-
-    def __init__(self, valid_things_dict="9C.txt"):
-        self._valid_things = dict()
-        with open(valid_things_dict, 'r') as f:
-            for line in f.readlines():
-                thing_string = line.rstrip().upper()
-                self._valid_things[thing_string] = True
+        for definition in self.map.things:
+            definition = dict(definition)
+            region = self.regions[definition.pop("region")]
+            cls = THING_TYPES[definition.pop("type", "Thing")]
+            if "magic" in definition:
+                definition["magic"] = getattr(World, definition["magic"])
+            region.inventory.add(cls(**definition))
+
+    def __init__(self, valid_things_dict="9C.txt", dictionary=None, map_file="world.json", world_map=None):
+        # the region and portal graph is built now; the dictionary loads on first use
+        if dictionary is None:
+            dictionary = Dictionary(valid_things_dict)
+        if world_map is None:
+            world_map = WorldMap.load(map_file)
+        self._dictionary = dictionary
+        self.map = world_map
         self._construct_regions()
         self._construct_portals()
         self._construct_things()
+        # route tables are built when first asked for, and shared with every new_game
+        self._route_tables = dict()
+        self._version = self._map_version()
+
+    def new_game(self):
+        """ a fresh world in its starting state, sharing this world's dictionary and indexes """
+        world = World.__new__(World)
+        world._dictionary = self._dictionary
+        world.map = self.map
+        world._construct_regions()
+        world._construct_portals()
+        world._construct_things()
+        # the portal graph is the same, so the routes are too
+        world._route_tables = self._route_tables
+        world._version = self._version
+        return world
+
+    def _map_version(self):
+        # identifies the map (regions, portals and starting things) that saved games refer to
+        digest = hashlib.sha1()
+        for region in self.regions:
+            digest.update(("%s|%s\n" % (region, region.inventory.all_names)).encode("utf-8"))
+        for portal in self.portals:
+            digest.update(("%s\n" % portal).encode("utf-8"))
+        return digest.hexdigest()[:12]
+
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def dictionary(self):
+        return self._dictionary
 
     def valid_thing_p(self, string):
         """ is the string a valid thing? """
-        return (string in self._valid_things)
+        return (string in self._dictionary.words)
 
     @property
     def valid_things(self):
-        return self._valid_things.keys()
+        return self._dictionary.words
+
+    @property
+    def phonetic_index(self):
+        return self._dictionary.phonetic_index
+
+    @property
+    def hidden_name_index(self):
+        return self._dictionary.hidden_name_index
+
+    def _route_table(self, have_gem):
+        have_gem = bool(have_gem)
+        if have_gem not in self._route_tables:
+            self._route_tables[have_gem] = RouteTable(self.map, have_gem)
+        return self._route_tables[have_gem]
+
+    def route(self, from_region, to_region, coins=None, have_gem=False):
+        """ cheapest route as ([regions], cost), or None if it cannot be reached (with coins) """
+        from_id = self.regions[from_region].id
+        to_id = self.regions[to_region].id
+        table = self._route_table(have_gem)
+        cost = table.cost(from_id, to_id)
+        if cost is None or (coins is not None and cost > coins):
+            return None
+        return ([self.regions[region_id] for region_id in table.path(from_id, to_id)], cost)
+
+    def reachable(self, from_region, coins, have_gem=False):
+        """ regions that can be reached from from_region with coins, cheapest first """
+        from_id = self.regions[from_region].id
+        table = self._route_table(have_gem)
+        return [self.regions[region_id] for cost, region_id in table.reachable(from_id, coins)]
 
     @property
     def description(self):
         return "World has %s regions, %s portals, and %s strings recognised as valid things" % (
             len(self.regions), 
             len(self.portals), 
-            len(self.valid_things)
+            self._dictionary.count
             )
 
+# compiled commands by command string, as the same few come up again and again (cleared if it gets too big)
+_compiled_commands = dict()
+_COMPILED_COMMANDS_MAX = 4096
+
+def compile_command(cmd):
+    """ (opcode, argument) for command string cmd, e.g. GA -> (OP_GO, 'A'), or None if it is not a command """
+    op = _compiled_commands.get(cmd)
+    if op is not None:
+        return op
+    if cmd.startswith(GO_CMD):
+        op = (OP_GO, sys.intern(cmd[len(GO_CMD):].upper()))
+    elif cmd.startswith(TAKE_CMD):
+        op = (OP_TAKE, sys.intern(cmd[len(TAKE_CMD):].upper()))
+    elif cmd.startswith(LEAVE_CMD):
+        op = (OP_LEAVE, sys.intern(cmd[len(LEAVE_CMD):].upper()))
+    elif cmd == UNDO_CMD:
+        op = (OP_UNDO, None)
+    elif cmd == REDO_CMD:
+        op = (OP_REDO, None)
+    elif cmd.startswith(QUIT_CMD):
+        op = (OP_QUIT, None)
+    else:
+        return None
+    if len(_compiled_commands) >= _COMPILED_COMMANDS_MAX:
+        _compiled_commands.clear()
+    _compiled_commands[cmd] = op
+    return op
+
+class TurnView:
+    """ everything shown to you for one state: portal costs, commands, legal moves and description
+
+    Derived in a single pass over the portals and inventories, and kept
+    by You until a go/take/leave (or anything else) changes the state. """
+
+    __slots__ = ("key", "portals", "affordable", "_you", "_commands", "_legal", "_description")
+
+    def __init__(self, you, key):
+        self.key = key
+        region = you.region
+        have_gem = you.have_gem_p
+        # (destination, cost for you, listed cost) for each portal out of here
+        self.portals = []
+        for portal in region.portals:
+            self.portals.append((portal.destination(region), portal.cost_with_gem(have_gem), portal.listed_cost))
+        self.affordable = [destination for destination, cost, listed_cost in self.portals if cost <= you.coins]
+        self._you = you
+        self._commands = None
+        self._legal = None
+        self._description = None
+
+    @property
+    def commands(self):
+        if self._commands is None:
+            self._commands = self._derive_commands(self._you)
+        return self._commands
+
+    @property
+    def legal(self):
+        """ compiled go/take/leave commands that would succeed, by any of the names they could use """
+        if self._legal is None:
+            self._legal = self._derive_legal(self._you)
+        return self._legal
+
+    @property
+    def description(self):
+        if self._description is None:
+            self._description = self._derive_description(self._you)
+        return self._description
+
+    def _derive_commands(self, you):
+        cmds = []
+        # valid go commands (accessible and affordable portals)
+        for destination in self.affordable:
+            cmds.append("%s%s" % (GO_CMD, destination.id))
+        # valid drop commands (all moveable things in my inventory)
+        for thing in you.inventory.things:
+            name = self._unique_name(you.inventory, thing)
+            if thing.moveable and name is not None:
+                cmds.append("%s%s" % (LEAVE_CMD, name))
+        # valid take commands (all things in region inventory that are moveable)
+        region_inventory = you.region_inventory
+        for thing in region_inventory.things:
+            name = self._unique_name(region_inventory, thing)
+            if thing.moveable and name is not None:
+                cmds.append("%s%s" % (TAKE_CMD, name))
+        return cmds
+
+    @staticmethod
+    def _unique_name(inventory, thing):
+        # the first of thing's names that picks it out alone (None if it has none, e.g. no names at all)
+        for name in thing.names:
+            if len(inventory.get(name)) == 1:
+                return name
+        return None
+
+    def _derive_legal(self, you):
+        legal = set()
+        # go takes a region by id or by name
+        for destination in self.affordable:
+            legal.add((OP_GO, destination.id))
+            legal.add((OP_GO, destination.name))
+        # a name only works if it picks out a single thing
+        for thing in you.inventory.things:
+            if thing.moveable:
+                for name in thing.names:
+                    if len(you.inventory.get(name)) == 1:
+                        legal.add((OP_LEAVE, name))
+        region_inventory = you.region_inventory
+        for thing in region_inventory.things:
+            if thing.moveable:
+                for name in thing.names:
+                    if len(region_inventory.get(name)) == 1:
+                        legal.add((OP_TAKE, name))
+        return frozenset(legal)
+
+    def _derive_description(self, you):
+        # describe portals and their current cost
+        portal_descriptions = []
+        for destination, portal_cost, listed_cost in self.portals:
+            portal_description = str(destination)
+            if listed_cost != portal_cost:
+                # portal is at a special rate
+                portal_description += " at a special cost of %s (normally %s)" % (portal_cost, listed_cost)
+            else:
+                portal_description += " at a cost of %s" % (portal_cost)
+            portal_descriptions.append(portal_description)
+        descriptions = ["%s" % (str(you))]
+        if you.coins > 0:
+            descriptions.append(", with %s coins" % (you.coins))
+        else:
+            descriptions.append(", devoid of coins!")
+        descriptions.append(" in the region of %s" % (you.region))
+        descriptions.append(" with portals to:\n%s" % ("\n".join(portal_descriptions)))
+        if not you.inventory.empty_p:
+            descriptions.append("\nCarrying: %s" % (str(you.inventory)))
+        if you.region.monument:
+            descriptions.append("\nThere is a monument to %s here!!!" % (str(you.region.monument)))
+        if not you.region_inventory.empty_p:
+            descriptions.append("\nYou see some 'things': %s" % (str(you.region_inventory)))
+        return "".join(descriptions)
+
+class Journal:
+    """ reversible deltas for each go/take/leave, so undo and redo are O(1)
+
+    A delta is (region before, coins before, region after, coins after,
+    thing moved, inventory it left, inventory it joined, command, step),
+    with no thing for a go. The command is the one that made the move
+    (None if it was not made through a command) and step is where it
+    went in the command history, so undo takes out just that entry and
+    redo puts it back. """
+
+    __slots__ = ("_done", "_undone")
+
+    def __init__(self):
+        self._done = []
+        self._undone = []
+
+    def record(self, delta):
+        self._done.append(delta)
+        self._undone = []
+
+    @property
+    def undo_p(self):
+        return len(self._done) > 0
+
+    @property
+    def redo_p(self):
+        return len(self._undone) > 0
+
+    def undo(self):
+        delta = self._done.pop()
+        self._undone.append(delta)
+        return delta
+
+    def redo(self, step):
+        """ the last undone delta, done again, with its command going back into the history at step """
+        delta = self._undone.pop()[:-1] + (step,)
+        self._done.append(delta)
+        return delta
+
+    def clear(self):
+        """ forget everything, e.g. after a change the journal can't take back """
+        self._done = []
+        self._undone = []
+
 class You:
-    def __init__(self, region, coins=0, **kwargs):
+    __slots__ = ("region", "coins", "events", "_inventory", "_region_inventories", "_command_history", "_journal",
+                 "_changed_regions", "_view", "quit")
+
+    def __init__(self, region, coins=0, copy_on_write=False, events=None, **kwargs):
         self.region = region
         self.coins = coins
+        # where what happens to you is reported: by default, printed straight away
+        self.events = events if events is not None else TextSink(buffered=False)
         self._inventory = Inventory(**kwargs)
+        # with copy_on_write, each region's inventory is shared (e.g. with
+        # other players) until you change it, when you get your own copy
+        self._region_inventories = dict() if copy_on_write else None
         self._command_history = []
+        self._journal = Journal()
+        # regions whose things you have changed (for snapshots)
+        self._changed_regions = dict()
+        self._view = None
         self.quit = False
 
     def __str__(self):
@@ -426,113 +1917,249 @@ class You:
     def step(self):
         return len(self._command_history)
 
+    @property
+    def region_inventory(self):
+        """ the inventory of the region you are in, as you see it """
+        return self.inventory_of(self.region)
+
+    def inventory_of(self, region):
+        """ the inventory of region as you see it (your own copy, if you have changed it) """
+        if self._region_inventories is not None and region in self._region_inventories:
+            return self._region_inventories[region]
+        return region.inventory
+
+    def changeable_region_inventory(self):
+        """ the inventory of the region you are in, copied first if it is shared """
+        self._changed_regions[self.region] = None
+        if self._region_inventories is None:
+            return self.region.inventory
+        if self.region not in self._region_inventories:
+            self._region_inventories[self.region] = self.region.inventory.copy()
+        return self._region_inventories[self.region]
+
     @property
     def have_gem_p(self):
-        return self.inventory.have_gem_p or self.region.inventory.have_gem_p
+        return self.inventory.have_gem_p or self.region_inventory.have_gem_p
+
+    @property
+    def view(self):
+        """ TurnView of the current state, rebuilt only when the state has changed """
+        region_inventory = self.region_inventory
+        key = (self.region, self.coins, self.region.monument, self.inventory.version, region_inventory, region_inventory.version)
+        if self._view is None or self._view.key != key:
+            self._view = TurnView(self, key)
+        return self._view
 
     @property
     def description(self):
-        # describe portals and their current cost
-        portal_descriptions = []
-        for portal in self.region.portals:
-            portal_description = str(portal.destination(self.region))
-            portal_cost = portal.cost(self)
-            listed_cost = portal.listed_cost
-            if listed_cost != portal_cost:
-                # portal is at a special rate
-                portal_description += " at a special cost of %s (normally %s)" % (portal_cost, listed_cost)
-            else:
-                portal_description += " at a cost of %s" % (portal_cost)
-            portal_descriptions.append(portal_description)
-        descriptions = ["%s" % (str(self))]
-        if self.coins > 0:
-            descriptions.append(", with %s coins" % (self.coins))
-        else:
-            descriptions.append(", devoid of coins!")
-        descriptions.append(" in the region of %s" % (self.region))
-        descriptions.append(" with portals to:\n%s" % ("\n".join(portal_descriptions)))
-        if not self.inventory.empty_p:
-            descriptions.append("\nCarrying: %s" % (str(self.inventory)))
-        if self.region.monument:
-            descriptions.append("\nThere is a monument to %s here!!!" % (str(self.region.monument)))
-        if not self.region.inventory.empty_p:
-            descriptions.append("\nYou see some 'things': %s" % (str(self.region.inventory)))
-        return "".join(descriptions)
+        return self.view.description
 
-    def go(self, portal_id):
+    def _record(self, region_before, coins_before, thing, from_inventory, to_inventory, cmd):
+        # cmd (if any) is about to go into the command history, at the next step
+        self._journal.record((region_before, coins_before, self.region, self.coins, thing, from_inventory, to_inventory,
+                              cmd, len(self._command_history)))
+
+    def go(self, portal_id, cmd=None):
         if portal_id in self.region.portals:
-            return self.region.portals[portal_id].transit(self)
+            region, coins = self.region, self.coins
+            if not self.region.portals[portal_id].transit(self):
+                return False
+            self._record(region, coins, None, None, None, cmd)
+            return True
         else:
-            print("ERROR: you cannot get to %s from here" % (portal_id))
+            self.events.emit(Event("no_portal", region=portal_id))
+            suggestions = [(distance, name) for distance, name in
+                           self.region.world.map.name_index.near(portal_id, typo_allowance(portal_id))
+                           if name in self.region.portals]
+            self._suggest(closest(suggestions))
             return False
 
-    def take(self, id):
-        things = self.region.inventory.get(id)
+    def _suggest(self, names):
+        if names:
+            self.events.emit(Event("did_you_mean", names=names))
+
+    def take(self, id, cmd=None):
+        things = self.region_inventory.get(id) or []
         if len(things) > 1:
-            print("ERROR: attempted to take more than one thing: %s" % id)
+            self.events.emit(Event("ambiguous_take", name=id))
             return False
         elif len(things) < 1:
-            print("ERROR: no thing to take: %s" % id)
+            self.events.emit(Event("no_thing_to_take", name=id))
+            self._suggest(closest(self.region_inventory.near(id, typo_allowance(id))))
             return False
         else:
-            thing = self.region.inventory.remove(things[0])
+            region_inventory = self.changeable_region_inventory()
+            thing = region_inventory.remove(things[0])
             if thing:
                 self.inventory.add(thing)
+                self._record(self.region, self.coins, thing, region_inventory, self.inventory, cmd)
+                self.events.emit(Event("took", thing=thing))
+            else:
+                self.events.emit(Event("not_moveable", thing=things[0]))
         return thing
 
-    def leave(self, id):
-        things = self.inventory.get(id)
+    def leave(self, id, cmd=None):
+        things = self.inventory.get(id) or []
         if len(things) > 1:
-            print("ERROR: attempted to leave more than one thing: %s" % id)
+            self.events.emit(Event("ambiguous_leave", name=id))
             return False
         elif len(things) < 1:
-            print("ERROR: no thing to leave: %s" % id)
+            self.events.emit(Event("no_thing_to_leave", name=id))
+            self._suggest(closest(self.inventory.near(id, typo_allowance(id))))
             return False
         else:
-            self.region.inventory.add(self.inventory.remove(things[0]))
-        return things[0]
+            thing = self.inventory.remove(things[0])
+            if not thing:
+                self.events.emit(Event("not_moveable", thing=things[0]))
+                return False
+            region_inventory = self.changeable_region_inventory()
+            region_inventory.add(thing)
+            self._record(self.region, self.coins, thing, self.inventory, region_inventory, cmd)
+            self.events.emit(Event("left", thing=thing))
+        return thing
+
+    def undo(self):
+        """ take back your last go/take/leave """
+        if not self._journal.undo_p:
+            self.events.emit(Event("nothing_to_undo"))
+            return False
+        delta = self._journal.undo()
+        region_before, coins_before, region_after, coins_after, thing, from_inventory, to_inventory, cmd, step = delta
+        history = self._command_history
+        # commands that moved nothing (a quit) may have come since, so take out just this one
+        if cmd is not None and step < len(history) and history[step] == cmd:
+            del history[step]
+        if thing is not None:
+            from_inventory.add(to_inventory.remove(thing))
+        self.region, self.coins = region_before, coins_before
+        return True
+
+    def redo(self):
+        """ do again the last go/take/leave you took back """
+        if not self._journal.redo_p:
+            self.events.emit(Event("nothing_to_redo"))
+            return False
+        delta = self._journal.redo(len(self._command_history))
+        region_before, coins_before, region_after, coins_after, thing, from_inventory, to_inventory, cmd, step = delta
+        if thing is not None:
+            to_inventory.add(from_inventory.remove(thing))
+        self.region, self.coins = region_after, coins_after
+        if cmd is not None:
+            self._command_history.append(cmd)
+        return True
+
+    def snapshot(self):
+        """ your game as JSON-ready data: only what has changed, plus the version of the map it is on """
+        return {
+            "world": self.region.world.version,
+            "region": self.region.id,
+            "coins": self.coins,
+            "history": list(self._command_history),
+            "inventory": [thing.record for thing in self.inventory.things],
+            "regions": dict((region.id, [thing.record for thing in self.inventory_of(region).things])
+                            for region in self._changed_regions),
+        }
+
+    @classmethod
+    def restore(cls, world, snapshot, copy_on_write=False, events=None):
+        """ You, in the state saved by snapshot, in a new game of world
+
+        With copy_on_write, world itself is shared (as by the game
+        server) and only the changed regions get inventories of their
+        own, which makes branching from a saved position cheap. """
+        if snapshot["world"] != world.version:
+            raise ValueError("snapshot is of map version %s, not %s" % (snapshot["world"], world.version))
+        if not copy_on_write:
+            world = world.new_game()
+        you = cls(world.regions[snapshot["region"]], coins=snapshot["coins"], copy_on_write=copy_on_write, events=events)
+        for record in snapshot["inventory"]:
+            you.inventory.add(Thing.from_record(record))
+        for region_id, records in snapshot["regions"].items():
+            region = world.regions[region_id]
+            inventory = Inventory()
+            for record in records:
+                inventory.add(Thing.from_record(record))
+            if copy_on_write:
+                you._region_inventories[region] = inventory
+            else:
+                region.inventory = inventory
+            you._changed_regions[region] = None
+        you._command_history = list(snapshot["history"])
+        return you
 
     @property
     def commands(self):
-        cmds = []
-        # valid go commands (accessible and affordable portals)
-        for portal in self.region.portals:
-            cmds.append("%s%s" % (GO_CMD, portal.destination(self.region).id))
-        # valid drop commands (all things in my inventory)
-        for thing in self.inventory.things:
-            cmds.append("%s%s" % (LEAVE_CMD, thing.id))
-        # valid take commands (all things in region inventory that are moveable)
-        for thing in self.region.inventory.things:
-            if thing.moveable:
-                cmds.append("%s%s" % (TAKE_CMD, thing.id))
-        return cmds
+        return self.view.commands
 
-    def command(self, cmd):
-        if cmd.startswith(GO_CMD):
-            # GO (transit portal)
-            dest = cmd[len(GO_CMD):].upper()
-            if not self.go(dest):
-                print("ERROR: could not go to %s" % (dest))
-                return False
-        elif cmd.startswith(TAKE_CMD):
-            name = cmd[len(TAKE_CMD):].upper()
-            if not self.take(name):
-                print("ERROR: could not take %s" % (name))
-                return False
-        elif cmd.startswith(LEAVE_CMD):
-            name = cmd[len(LEAVE_CMD):].upper()
-            if not self.leave(name):
-                print("ERROR: could not leave %s" % (name))
-                return False
-        elif cmd.startswith(QUIT_CMD):
-            self.quit = True
-            print("\n".join(self._command_history))
-        else:
-            print("ERROR: did not understand command %s" % cmd)
+    def legal_p(self, cmd):
+        """ would cmd succeed now? (a set lookup, against the legal moves of the current view) """
+        op = compile_command(cmd)
+        if op is None:
+            return False
+        if op[0] == OP_UNDO:
+            return self._journal.undo_p
+        if op[0] == OP_REDO:
+            return self._journal.redo_p
+        return op[0] == OP_QUIT or op in self.view.legal
+
+    def _go_command(self, dest, cmd):
+        if not self.go(dest, cmd):
+            self.events.emit(Event("could_not_go", region=dest))
+            return False
+        self._command_history.append(cmd)
+        return True
+
+    def _take_command(self, name, cmd):
+        if not self.take(name, cmd):
+            self.events.emit(Event("could_not_take", name=name))
+            return False
+        self._command_history.append(cmd)
+        return True
+
+    def _leave_command(self, name, cmd):
+        if not self.leave(name, cmd):
+            self.events.emit(Event("could_not_leave", name=name))
             return False
         self._command_history.append(cmd)
         return True
 
+    # undo and redo rewrite the command history rather than adding to it
+    def _undo_command(self, argument, cmd):
+        return self.undo()
+
+    def _redo_command(self, argument, cmd):
+        return self.redo()
+
+    def _quit_command(self, argument, cmd):
+        self.quit = True
+        self.events.emit(Event("quit", history=list(self._command_history)))
+        self._command_history.append(cmd)
+        return True
+
+    # by opcode
+    _OPERATIONS = (_go_command, _take_command, _leave_command, _undo_command, _redo_command, _quit_command)
+
+    def command(self, cmd):
+        op = compile_command(cmd)
+        if op is None:
+            self.events.emit(Event("parse_error", cmd=cmd))
+            return False
+        return self._OPERATIONS[op[0]](self, op[1], cmd)
+
+    def apply_many(self, cmds, stop_on_error=False):
+        """ carry out a whole sequence of commands in one call, rendering nothing in between
+
+        Returns whether each command succeeded, stopping after a quit
+        (or, with stop_on_error, after the first that fails). """
+        command = self.command
+        results = []
+        for cmd in cmds:
+            ok = command(cmd)
+            results.append(ok)
+            if self.quit or (stop_on_error and not ok):
+                break
+        return results
+
 def main():
     # create the world
     world = World()
@@ -540,14 +2167,19 @@ def main():
     # describe the world
     print(world.description)
 
-    # enter the world
-    you = You(world.regions["A"], coins=15)
+    # nothing needs the dictionary until you try some magic, so load it while you think
+    world.dictionary.preload()
+
+    # enter the world, with what happens to you shown once per turn
+    events = TextSink(sys.stdout)
+    you = You(world.regions["A"], coins=15, events=events)
 
     # describe the world as you see it and accept commands from stdin
     while not you.quit:
         print(you.description)
         print("Commands: %s" % you.commands)
         you.command(input("%s> " % you.step).upper())
+        events.flush()
 
 if __name__ == "__main__":
     main()